@@ -10,17 +10,200 @@ Redistribution and use in source and binary forms, with or without modification,
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import nibabel as nib, numpy as np, sys, argparse
-from skimage.morphology import label
-from skimage.measure import regionprops
+import nibabel as nib, numpy as np, sys, os, argparse, csv
+from multiprocessing import Pool
+import scipy.ndimage
 import nibabel.nifti1
-from utils import write_rec_file
+from nibabel.openers import Opener
+from utils import write_rec_file, job_signature, job_params, up_to_date, add_incremental_args
 
-def label_max_prob(mask_weighted,label,nlabel): 
-    weights=[]
-    for val in range(1,nlabel+1):
-        weights.append(np.sum((label==val)*mask_weighted))
-    return np.argmax(np.array(weights))+1
+CONNECTIVITY_RANK={6:1,18:2,26:3}
+
+def label_components(mask, connectivity:int=6):
+    '''
+    Label connected components of a binary mask with 6, 18 or 26 neighbour connectivity.
+    Returns the label image and the number of components.
+    '''
+    if connectivity not in CONNECTIVITY_RANK: raise ValueError('connectivity must be 6, 18 or 26')
+    structure=scipy.ndimage.generate_binary_structure(mask.ndim,min(CONNECTIVITY_RANK[connectivity],mask.ndim))
+    return scipy.ndimage.label(mask>0,structure=structure)
+
+def component_stats(label, nlabel, weights):
+    '''
+    Statistics of all components in one pass over the image.
+    Returns a dict of arrays indexed by component label-1: voxels, weighted_sum, max_prob, centroid [n,3]
+    (voxel coordinates) and bbox [n,3,2] (first and last voxel).
+    '''
+    lb=label.ravel()
+    index=np.arange(1,nlabel+1)
+    voxels=np.bincount(lb,minlength=nlabel+1)[1:]
+    weighted_sum=np.bincount(lb,weights=weights.ravel(),minlength=nlabel+1)[1:]
+    max_prob=np.asarray(scipy.ndimage.maximum(weights,label,index)) if nlabel>0 else np.zeros(0)
+    centroid=np.array(scipy.ndimage.center_of_mass(np.ones(label.shape,dtype=np.uint8),label,index)).reshape(-1,label.ndim)
+    bbox=np.array([[[sl.start,sl.stop-1] for sl in obj] for obj in scipy.ndimage.find_objects(label,nlabel)]).reshape(-1,label.ndim,2)
+    return dict(voxels=voxels,weighted_sum=weighted_sum,max_prob=max_prob,centroid=centroid,bbox=bbox)
+
+def select_components(stats, top_k:int=1, min_size:int=0, min_prob:float=None):
+    '''
+    Labels of components with at least min_size voxels and maximum probability of at least min_prob,
+    ordered by decreasing weighted sum; at most top_k of them (all if top_k is 0).
+    '''
+    keep=stats['voxels']>=min_size
+    if min_prob is not None: keep&=stats['max_prob']>=min_prob
+    labels=np.nonzero(keep)[0]
+    labels=labels[np.argsort(-stats['weighted_sum'][labels],kind='stable')]
+    if top_k>0: labels=labels[:top_k]
+    return labels+1
+
+def read_slab(file:str, z0:int, z1:int):
+    '''
+    Read planes z0:z1 of a 3D image, or of the first frame of a 4D image, from the array proxy.
+    '''
+    img=nib.load(file)
+    if len(img.shape)==4: return np.asanyarray(img.dataobj[:,:,z0:z1,0])
+    return np.asanyarray(img.dataobj[:,:,z0:z1])
+
+def label_slab(job):
+    '''
+    Label one z-slab and compute its component statistics. Runs in a worker process.
+    job: (mask file, weights file, z0, z1, connectivity)
+    Returns the number of components, their statistics in global voxel coordinates,
+    the first and last label planes and the first voxel (raster order) of each component.
+    '''
+    mask_file,weights_file,z0,z1,connectivity=job
+    mask=read_slab(mask_file,z0,z1)
+    lb,n=label_components(mask,connectivity)
+    stats=component_stats(lb,n,mask*read_slab(weights_file,z0,z1).astype(np.float32))
+    stats['centroid'][:,2]+=z0
+    stats['bbox'][:,2,:]+=z0
+    first=np.asarray(scipy.ndimage.minimum(np.arange(lb.size).reshape(lb.shape),lb,np.arange(1,n+1)),dtype=np.int64).reshape(-1)
+    first=np.stack(np.unravel_index(first,lb.shape),axis=1)
+    first[:,2]+=z0
+    return n,stats,lb[:,:,0].copy(),lb[:,:,-1].copy(),first
+
+def slab_mask(job):
+    '''
+    Relabel one z-slab and return the mask of the kept components. Runs in a worker process.
+    job: (mask file, z0, z1, connectivity, bool array indexed by slab label)
+    '''
+    mask_file,z0,z1,connectivity,keep=job
+    lb,n=label_components(read_slab(mask_file,z0,z1),connectivity)
+    return keep[lb].astype(np.uint8)
+
+def union_find(n:int, pairs):
+    '''
+    Root of each of n elements after joining all (a,b) pairs; the smallest element of a set is its root.
+    '''
+    parent=np.arange(n)
+    def find(a):
+        while parent[a]!=a:
+            parent[a]=parent[parent[a]]; a=parent[a]
+        return a
+    for a,b in pairs:
+        ra,rb=find(a),find(b)
+        if ra!=rb: parent[max(ra,rb)]=min(ra,rb)
+    for i in range(n): parent[i]=parent[parent[i]]
+    return parent
+
+def boundary_pairs(plane0, plane1, connectivity:int):
+    '''
+    Pairs of labels that touch across two adjacent planes under the given connectivity.
+    '''
+    structure=scipy.ndimage.generate_binary_structure(3,CONNECTIVITY_RANK[connectivity])
+    nx,ny=plane0.shape
+    pairs=[]
+    for dx in (-1,0,1):
+        for dy in (-1,0,1):
+            if not structure[1+dx,1+dy,2]: continue
+            a=plane0[max(0,-dx):nx-max(0,dx),max(0,-dy):ny-max(0,dy)]
+            b=plane1[max(0,dx):nx-max(0,-dx),max(0,dy):ny-max(0,-dy)]
+            touch=(a>0)&(b>0)
+            pairs+=[np.stack([a[touch],b[touch]],axis=1)]
+    return np.unique(np.concatenate(pairs),axis=0)
+
+def merge_slabs(results, shape, connectivity:int):
+    '''
+    Join slab components that touch across slab boundaries and merge their statistics.
+    Components are numbered by their first voxel in raster order, as in global labelling.
+    Returns the number of components, their statistics and, for each slab, the map slab label -> component.
+    '''
+    counts=np.array([r[0] for r in results])
+    offsets=np.concatenate([[0],np.cumsum(counts)])
+    pairs=[np.zeros((0,2),dtype=np.int64)]
+    for s in range(len(results)-1):
+        p=boundary_pairs(results[s][3],results[s+1][2],connectivity)
+        pairs+=[np.stack([p[:,0]+offsets[s],p[:,1]+offsets[s+1]],axis=1)]
+    roots=union_find(offsets[-1]+1,np.concatenate(pairs))[1:]
+    
+    cat=lambda key: np.concatenate([r[1][key] for r in results])
+    voxels,weighted_sum,max_prob,centroid,bbox=cat('voxels'),cat('weighted_sum'),cat('max_prob'),cat('centroid'),cat('bbox')
+    first=np.concatenate([r[4] for r in results])
+    first=np.ravel_multi_index(tuple(first.T),shape) if first.shape[0] else np.zeros(0,dtype=np.int64)
+    
+    uroots,comp=np.unique(roots,return_inverse=True)
+    ncomp=uroots.shape[0]
+    comp_first=np.full(ncomp,np.iinfo(np.int64).max); np.minimum.at(comp_first,comp,first)
+    rank=np.empty(ncomp,dtype=np.int64); rank[np.argsort(comp_first)]=np.arange(ncomp)
+    comp=rank[comp]
+    
+    stats=dict(voxels=np.bincount(comp,weights=voxels,minlength=ncomp).astype(np.int64),
+               weighted_sum=np.bincount(comp,weights=weighted_sum,minlength=ncomp),
+               max_prob=np.full(ncomp,-np.inf),
+               centroid=np.stack([np.bincount(comp,weights=centroid[:,i]*voxels,minlength=ncomp) for i in range(3)],axis=1),
+               bbox=np.zeros((ncomp,3,2),dtype=np.int64))
+    stats['centroid']/=np.maximum(stats['voxels'],1)[:,None]
+    np.maximum.at(stats['max_prob'],comp,max_prob)
+    stats['bbox'][:,:,0]=np.iinfo(np.int64).max
+    np.minimum.at(stats['bbox'][:,:,0],comp,bbox[:,:,0])
+    np.maximum.at(stats['bbox'][:,:,1],comp,bbox[:,:,1])
+    slab_maps=[ np.concatenate([[0],comp[offsets[s]:offsets[s+1]]+1]) for s in range(len(results)) ]
+    return ncomp,stats,slab_maps
+
+def chunked_components(mask_file:str, weights_file:str, out_file:str, connectivity:int=6, slab_size:int=64, nworkers:int=4,
+                       top_k:int=1, min_size:int=0, min_prob:float=None):
+    '''
+    Connected component selection on z-slabs read from the array proxies on a pool of workers,
+    with components joined across slab boundaries by union-find. Gives the same components as
+    global labelling. The output mask (uint8) is written to out_file slab by slab, so peak memory
+    is proportional to the slab size.
+    Returns component statistics and selected component labels.
+    '''
+    mask=nib.load(mask_file)
+    shape=mask.shape[:3]
+    slabs=[(z0,min(z0+slab_size,shape[2])) for z0 in range(0,shape[2],slab_size)]
+    hdr=nib.Nifti1Header.from_header(mask.header)
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(np.uint8)
+    hdr.set_slope_inter(1,0)
+    hdr['vox_offset']=0
+    with Pool(nworkers) as pool:
+        results=pool.map(label_slab,[(mask_file,weights_file,z0,z1,connectivity) for z0,z1 in slabs])
+        nlabel,stats,slab_maps=merge_slabs(results,shape,connectivity)
+        print('found {} components in {} slabs'.format(nlabel,len(slabs)))
+        selected=select_components(stats,top_k,min_size,min_prob)
+        keep=[np.isin(m,selected)&(m>0) for m in slab_maps]
+        jobs=[(mask_file,z0,z1,connectivity,k) for (z0,z1),k in zip(slabs,keep)]
+        print ('saving ',out_file)
+        with Opener(out_file,'wb') as f:
+            hdr.write_to(f)
+            for m in pool.imap(slab_mask,jobs):
+                f.write(np.ascontiguousarray(m.transpose(2,1,0)).tobytes())
+    return stats,selected
+
+def write_report(file, stats, selected, voxel_vol_mm3:float=1.0):
+    '''
+    Write per-component statistics to a CSV file.
+    '''
+    selected=set(selected.tolist())
+    with open(file,'w',newline='') as f:
+        w=csv.writer(f)
+        w.writerow(['label','voxels','volume_mm3','weighted_sum','mean_prob','max_prob',
+                    'centroid_i','centroid_j','centroid_k','bbox_i','bbox_j','bbox_k','selected'])
+        for i in range(stats['voxels'].shape[0]):
+            n=stats['voxels'][i]
+            w.writerow([i+1,n,n*voxel_vol_mm3,stats['weighted_sum'][i],stats['weighted_sum'][i]/max(n,1),stats['max_prob'][i]]+
+                       ['{:.2f}'.format(c) for c in stats['centroid'][i]]+
+                       ['{}:{}'.format(*b) for b in stats['bbox'][i]]+[int(i+1 in selected)])
 
 class DefParser(argparse.ArgumentParser):
     def error(self, message):
@@ -30,26 +213,48 @@ class DefParser(argparse.ArgumentParser):
         
 if __name__=="__main__":
     
-    p=DefParser(description='Extract single connected component with highest probability mask')
+    p=DefParser(description='Extract connected components with highest probability mask')
     p.add_argument('input_binary_mask',type=str,help='input binary mask with multiple segments')
     p.add_argument('input_weights_image',type=str,help='probability map for the given mask')
-    p.add_argument('output_binary_mask',type=str,help='output mask with most probable connected component')
+    p.add_argument('output_binary_mask',type=str,help='output mask with most probable connected component(s)')
+    p.add_argument('--connectivity',metavar='<int>',type=int,default=6,choices=[6,18,26],help='neighbour connectivity, 6, 18 or 26 [6]')
+    p.add_argument('--top_k',metavar='<int>',type=int,default=1,help='number of components to keep, 0 for all that pass the other criteria [1]')
+    p.add_argument('--min_size',metavar='<int>',type=int,default=0,help='minimum component size in voxels [0]')
+    p.add_argument('--min_prob',metavar='<float>',type=float,default=None,help='minimum of the component\'s maximum probability [None]')
+    p.add_argument('--slab_size',metavar='<int>',type=int,default=0,help='label z-slabs of this many planes in parallel, 0 for the whole volume [0]')
+    p.add_argument('--workers',metavar='<int>',type=int,default=4,help='number of worker processes with --slab_size [4]')
+    p.add_argument('--report',metavar='<csv file>',type=str,default=None,help='write per-component statistics to this CSV file [None]')
+    add_incremental_args(p)
 
     a=p.parse_args()
     mask_file,atlas,out=a.input_binary_mask,a.input_weights_image,a.output_binary_mask
+    sig=job_signature([mask_file,atlas],job_params('cc_maxp_mask',a,['incremental','hash','workers','slab_size']),a.hash)
+    if a.incremental and up_to_date(out,sig,[mask_file,atlas],'nii') and (a.report is None or up_to_date(a.report,sig,[mask_file,atlas])):
+        print(out,'is up to date')
+        sys.exit(0)
 
     mask=nib.load(mask_file)
-    atl=nib.load(atlas)
-    mask_raw=mask.get_fdata()
-    atl_raw=atl.get_fdata()
+    if a.slab_size>0:
+        stats,selected=chunked_components(mask_file,atlas,out,a.connectivity,a.slab_size,a.workers,
+                                          a.top_k,a.min_size,a.min_prob)
+    else:
+        atl=nib.load(atlas)
+        mask_raw=np.squeeze(np.asanyarray(mask.dataobj))
+        atl_raw=np.squeeze(atl.get_fdata(dtype=np.float32))
 
-    lb,nlabel=label(np.squeeze(mask_raw),return_num=True,connectivity=1)
+        lb,nlabel=label_components(mask_raw,a.connectivity)
+        print('found {} components'.format(nlabel))
     
-    mask_weighted=np.squeeze(mask_raw*atl_raw)
-    lmax=label_max_prob(mask_weighted,lb,nlabel)
-    out_label_image=nibabel.nifti1.Nifti1Image(lb==lmax,None,header=mask.header)
-
-    print ('saving ',out)
-    nibabel.nifti1.save(out_label_image,out)
-    write_rec_file(out,'nii',[mask_file,atlas])
-                
\ No newline at end of file
+        mask_weighted=mask_raw*atl_raw
+        stats=component_stats(lb,nlabel,mask_weighted)
+        selected=select_components(stats,a.top_k,a.min_size,a.min_prob)
+        out_mask=np.isin(lb,selected).astype(np.uint8)
+        out_label_image=nibabel.nifti1.Nifti1Image(out_mask,None,header=mask.header)
+        print ('saving ',out)
+        nibabel.nifti1.save(out_label_image,out)
+    print('selected components:',selected.tolist())
+    write_rec_file(out,'nii',[mask_file,atlas],sig)
+    if a.report is not None:
+        print('writing',a.report)
+        write_report(a.report,stats,selected,float(np.prod(mask.header.get_zooms()[:3])))
+        write_rec_file(a.report,infiles=[mask_file,atlas],signature=sig)
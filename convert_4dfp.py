@@ -0,0 +1,230 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import sys, os, argparse, numpy as np, nibabel as nib
+from multiprocessing import Pool
+from nibabel.openers import Opener
+from utils import IFH, Mapped4DFP, write_rec_file, job_signature, up_to_date, add_incremental_args
+
+'''
+Streaming 4dfp <-> NIFTI conversion.
+4dfp index to world: w[a] = mmppix[a]*(i[a]+1) - center[a] (0-based i, stored axis a), with stored axes
+(x,y,z) for transverse, (x,z,y) for coronal and (y,z,x) for sagittal orientation. 4dfp x points to
+patient left, so NIFTI (RAS) x is -w[x]; a transverse 4dfp image is stored right-anterior-superior first.
+'''
+
+#4dfp axis (x=0,y=1,z=2) of each stored axis, by IFH orientation.
+ORIENTATION_AXES={2:[0,1,2],3:[0,2,1],4:[1,2,0]}
+
+def ifh_to_affine(ifh):
+    '''
+    NIFTI affine of a 4dfp image from IFH orientation, mmppix and center.
+    '''
+    n=np.array(ifh.get_matrix_size()[:3],dtype=np.float64)
+    sf=[ifh.get('scaling factor (mm/pixel) [{}]'.format(i),1.0) for i in range(1,4)]
+    mmppix=np.array(ifh.get('mmppix',[sf[0],-sf[1],-sf[2]]),dtype=np.float64)
+    center=np.array(ifh.get('center',mmppix*(n+1)/2),dtype=np.float64)
+    axes=ORIENTATION_AXES.get(ifh.get('orientation',2),ORIENTATION_AXES[2])
+    affine=np.eye(4)
+    for a in range(3):
+        w=axes[a]; s=-1 if w==0 else 1
+        affine[w,a]=s*mmppix[a]
+        affine[w,3]+=s*(mmppix[a]-center[a])
+    return affine
+
+def affine_to_ifh(affine, shape, ifh=None):
+    '''
+    Transverse 4dfp IFH keys for a NIFTI image, and the orientation transform from the NIFTI
+    voxel axes to 4dfp storage order (see nibabel.orientations). Rotations cannot be stored in 4dfp and are dropped.
+    '''
+    ifh=IFH() if ifh is None else ifh
+    transform=nib.orientations.ornt_transform(nib.orientations.io_orientation(affine),
+                                              nib.orientations.axcodes2ornt(('L','P','I')))
+    aff=affine@nib.orientations.inv_ornt_aff(transform,shape[:3])
+    if not np.allclose(aff[:3,:3],np.diag(np.diag(aff[:3,:3])),atol=1e-4*np.abs(aff[:3,:3]).max()):
+        print('WARNING: oblique affine, rotation is not stored in 4dfp')
+    d=np.diag(aff)[:3]
+    mmppix=[-d[0],d[1],d[2]]
+    center=[mmppix[0]+aff[0,3],mmppix[1]-aff[1,3],mmppix[2]-aff[2,3]]
+    ifh.set('orientation',2)
+    for i in range(3): ifh.set('scaling factor (mm/pixel) [{}]'.format(i+1),float(abs(d[i])))
+    ifh.set('mmppix',[float(m) for m in mmppix])
+    ifh.set('center',[float(c) for c in center])
+    return ifh,transform
+
+class ReorientedProxy:
+    '''
+    Read-only view of an array proxy in another voxel axis order: slicing reads only the
+    requested part of the input and flips/transposes it in memory.
+    '''
+    def __init__(self, dataobj, transform, dtype=None):
+        self.dataobj=dataobj
+        self.transform=transform
+        in_shape=dataobj.shape
+        self.in_axis=[int(np.nonzero(transform[:,0]==j)[0][0]) for j in range(3)]
+        self.flip=[transform[i,1]==-1 for i in self.in_axis]
+        self.shape=tuple(in_shape[i] for i in self.in_axis)+tuple(in_shape[3:])
+        self.dtype=np.dtype(dataobj.dtype if dtype is None else dtype)
+
+    def __getitem__(self, key):
+        key=tuple(key)+(slice(None),)*(len(self.shape)-len(key))
+        in_key=[None]*3
+        for j in range(3):
+            i=self.in_axis[j]; n=self.shape[j]
+            st,en,_=key[j].indices(n)
+            in_key[i]=slice(n-en,n-st) if self.flip[j] else slice(st,en)
+        data=np.asanyarray(self.dataobj[tuple(in_key)+key[3:]])
+        data=data.transpose(self.in_axis+list(range(3,data.ndim)))
+        return np.flip(data,axis=[j for j in range(3) if self.flip[j]]) if any(self.flip) else data
+
+def fdfp_to_nifti(root:str, out_file:str, slab_size:int=16, signature=None):
+    '''
+    Convert a 4dfp image to NIFTI, copying the memory-mapped payload in z-slabs with byte swapping as needed.
+    Voxels keep the 4dfp storage order; orientation goes into the affine.
+    '''
+    im=Mapped4DFP(root)
+    v=im.get_voxels()
+    shape=v.shape if v.shape[3]>1 else v.shape[:3]
+    dtype=v.dtype.newbyteorder('=')
+    affine=ifh_to_affine(im.ifh)
+    hdr=nib.Nifti1Header()
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_zooms(tuple(nib.affines.voxel_sizes(affine))+((1.0,) if len(shape)>3 else ()))
+    hdr.set_qform(affine,code=1)
+    hdr.set_sform(affine,code=1)
+    hdr.set_xyzt_units('mm','sec')
+    hdr.set_slope_inter(1,0)
+    print('writing',out_file)
+    with Opener(out_file,'wb') as f:
+        hdr.write_to(f)
+        for t in range(v.shape[3]):
+            for z0 in range(0,v.shape[2],slab_size):
+                f.write(np.ascontiguousarray(v[:,:,z0:z0+slab_size,t].transpose(2,1,0),dtype=dtype).tobytes())
+    write_rec_file(out_file,infiles=[root+'.4dfp.img'],signature=signature)
+
+def nifti_to_4dfp(in_file:str, root:str, slab_size:int=16, keep_dtype:bool=False, signature=None):
+    '''
+    Convert a NIFTI image to transverse 4dfp, reading z-slabs of the reoriented image from the array proxy.
+    Output is big endian float32 (the 4dfp standard) unless keep_dtype is set.
+    '''
+    img=nib.load(in_file)
+    ifh,transform=affine_to_ifh(img.affine,img.shape)
+    scaled=img.dataobj.slope!=1 or img.dataobj.inter!=0
+    dtype=img.get_data_dtype() if keep_dtype and not scaled else np.float32
+    Mapped4DFP.write(root,ReorientedProxy(img.dataobj,transform),ifh,dtype=dtype,
+                     slab_size=slab_size,infile_list=[in_file],signature=signature)
+
+def get_4dfp_root(file:str):
+    for ext in ['.4dfp.img','.4dfp.ifh','.4dfp.hdr','.4dfp']:
+        if file.endswith(ext): return file[:-len(ext)]
+    return None
+
+def get_nifti_root(file:str):
+    for ext in ['.nii.gz','.nii']:
+        if file.endswith(ext): return file[:-len(ext)]
+    return None
+
+def overwrites_source(outfiles:list):
+    '''
+    True if any of a job's output files exists and was not written by convert_4dfp, according to its .rec log.
+    '''
+    if not any([os.path.exists(f) for f in outfiles]): return False
+    rec=outfiles[0]+'.rec'
+    if not os.path.isfile(rec): return True
+    with open(rec,'r') as f:
+        return 'convert_4dfp' not in f.readline()
+
+def get_jobs(inputs:list, to:str, out_dir:str=None, gz:bool=False):
+    '''
+    Conversion jobs (direction, input, output) for input files and directories. to: 'nifti' or '4dfp',
+    directories contribute only files of the other format. Jobs whose output is an input or output of
+    another job, or would overwrite an existing file not written by convert_4dfp, are skipped.
+    '''
+    files=[]
+    for inp in inputs:
+        if os.path.isdir(inp):
+            names=sorted(os.listdir(inp))
+            files+=[os.path.join(inp,f) for f in names if (f.endswith('.4dfp.ifh') if to=='nifti' else get_nifti_root(f))]
+        else:
+            files+=[inp]
+    candidates=[]
+    for f in files:
+        root=get_4dfp_root(f) if to=='nifti' else get_nifti_root(f)
+        if root is None:
+            print('WARNING: not a {} file, skipping'.format('4dfp' if to=='nifti' else 'NIFTI'),f)
+            continue
+        out=root if out_dir is None else os.path.join(out_dir,os.path.basename(root))
+        if to=='nifti':
+            out+='.nii.gz' if gz else '.nii'
+            candidates+=[(('nifti',root,out),[root+'.4dfp.img',root+'.4dfp.ifh'],[out])]
+        else:
+            candidates+=[(('4dfp',f,out),[f],[out+'.4dfp.img',out+'.4dfp.ifh'])]
+    batch_inputs=set([os.path.realpath(f) for c in candidates for f in c[1]])
+    batch_outputs=set()
+    jobs=[]
+    for job,infiles,outfiles in candidates:
+        real=[os.path.realpath(f) for f in outfiles]
+        if any([f in batch_inputs or f in batch_outputs for f in real]):
+            print('WARNING: output of',job[1],'is an input or output of another job, skipping')
+            continue
+        if overwrites_source(outfiles):
+            print('WARNING: {} exists and was not written by convert_4dfp, skipping'.format(outfiles[0]))
+            continue
+        batch_outputs.update(real)
+        jobs+=[job]
+    return jobs
+
+def run_job(job):
+    '''
+    Run one conversion job. Returns 'converted', 'skipped' (incremental and up to date) or None on error.
+    '''
+    direction,infile,outfile,slab_size,keep_dtype,incremental,content_hash=job
+    if direction=='nifti':
+        infiles,out=[infile+'.4dfp.img',infile+'.4dfp.ifh'],outfile
+    else:
+        infiles,out=[infile],outfile+'.4dfp.img'
+    try:
+        params=dict(tool='convert_4dfp',direction=direction,keep_dtype=keep_dtype and direction=='4dfp')
+        sig=job_signature(infiles,params,content_hash)
+        if incremental and up_to_date(out,sig,infiles):
+            print(out,'is up to date')
+            return 'skipped'
+        if direction=='nifti': fdfp_to_nifti(infile,outfile,slab_size,sig)
+        else: nifti_to_4dfp(infile,outfile,slab_size,keep_dtype,sig)
+    except Exception as e:
+        print('ERROR: cannot convert',infile,':',e)
+        return None
+    return 'converted'
+
+class DefParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+if __name__=="__main__":
+    p=DefParser(description='Convert 4dfp images to NIFTI and NIFTI images to 4dfp, streaming the voxel data')
+    p.add_argument('inputs',type=str,nargs='+',help='4dfp (.4dfp.ifh/.4dfp.img) or NIFTI files, or directories with them')
+    p.add_argument('--to',type=str,required=True,choices=['nifti','4dfp'],help='output format; directories contribute only files of the other format')
+    p.add_argument('--out_dir',metavar='<dir>',type=str,default=None,help='output directory [next to the input]')
+    p.add_argument('--gz',action='store_true',default=False,help='write compressed NIFTI [False]')
+    p.add_argument('--keep_dtype',action='store_true',default=False,help='keep the NIFTI data type in 4dfp output instead of float32 [False]')
+    p.add_argument('--slab_size',metavar='<int>',type=int,default=16,help='number of z planes copied at a time [16]')
+    p.add_argument('--workers',metavar='<int>',type=int,default=4,help='number of worker processes [4]')
+    add_incremental_args(p)
+    a=p.parse_args()
+
+    jobs=[j+(a.slab_size,a.keep_dtype,a.incremental,a.hash) for j in get_jobs(a.inputs,a.to,a.out_dir,a.gz)]
+    if a.out_dir is not None: os.makedirs(a.out_dir,exist_ok=True)
+    with Pool(a.workers) as pool:
+        res=pool.map(run_job,jobs)
+    print('converted {}, skipped {} up to date out of {} images'.format(res.count('converted'),res.count('skipped'),len(jobs)))
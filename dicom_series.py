@@ -0,0 +1,185 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os, threading, collections, numpy as np, pydicom
+
+'''
+Shared loader for DICOM series stored one per directory. load_series returns a DicomSeries with headers
+sorted by slice position, slice geometry and a voxel array that is read on first use.
+Series are kept in an in-process LRU cache keyed by directory path and modification time, so a directory
+that gains or loses files is reread. The cache budget (voxel arrays) is taken from PYMIPL_SERIES_CACHE_MB [1024],
+0 disables caching.
+'''
+
+def sort_dcms_by_slice_pos(input_dicom_path,dcm_files,stop_before_pixels=True):
+    '''
+    Sort DICOMs from an input directory (assumed to contain a single study) according to slice position
+    Output: a sorted list of dicts with file, dataset and z, or None if slice positions are missing
+    '''
+    dcmss=[]
+    for idx,dcm in enumerate(dcm_files):
+        ds = pydicom.dcmread(os.path.join(input_dicom_path,dcm), stop_before_pixels=stop_before_pixels)
+        if idx==0:
+            if 'ImagePositionPatient' in ds: sortTag='ImagePositionPatient'
+            elif 'SliceLocation' in ds: sortTag='SliceLocation'
+            else: return None
+        if not sortTag in ds: return None
+        if sortTag=='ImagePositionPatient': z=ds.ImagePositionPatient[2]
+        else: z=ds.SliceLocation
+        dcmss+=[dict(file=dcm,dataset=ds,z=z)]
+    return sorted(dcmss, key=lambda dcms: dcms['z'])
+
+def voxel_array_from_sorted_dicoms(dicomsSorted):
+    '''
+    Extract the [column,row,slice] voxel array from a list of sorted DICOM objects with pixel data.
+    '''
+    if len(dicomsSorted) < 1: return None
+    ds0=dicomsSorted[0]['dataset']
+    voxels=np.zeros([ds0.Columns,ds0.Rows,len(dicomsSorted)],dtype=ds0.pixel_array.dtype)
+    for i in range(len(dicomsSorted)):
+        voxels[:,:,i]=np.transpose(dicomsSorted[i]['dataset'].pixel_array)
+    return voxels
+
+class DicomSeries:
+    '''
+    DICOM series in one directory. dicoms: sorted list of dicts with file, dataset (header only) and z.
+    '''
+    def __init__(self,path,files=None):
+        self.path=path
+        self.mtime=os.stat(path).st_mtime_ns
+        files=next(os.walk(path))[2] if files is None else files
+        self.dicoms=sort_dcms_by_slice_pos(path,files)
+        if self.dicoms is None or len(self.dicoms)<1:
+            raise ValueError('cannot sort DICOM files in {} by slice position'.format(path))
+        self._voxels=None
+        self._lock=threading.Lock()
+        self._cache=None
+
+    def __len__(self):
+        return len(self.dicoms)
+
+    @property
+    def headers(self):
+        return [d['dataset'] for d in self.dicoms]
+
+    @property
+    def files(self):
+        return [os.path.join(self.path,d['file']) for d in self.dicoms]
+
+    @property
+    def z(self):
+        return np.array([float(d['z']) for d in self.dicoms])
+
+    @property
+    def shape(self):
+        ds=self.dicoms[0]['dataset']
+        return (int(ds.Columns),int(ds.Rows),len(self.dicoms))
+
+    @property
+    def spacing(self):
+        '''
+        Pixel spacing and slice thickness, mm.
+        '''
+        ds=self.dicoms[0]['dataset']
+        return np.array([float(ds.PixelSpacing[0]),float(ds.PixelSpacing[1]),float(ds.SliceThickness)])
+
+    @property
+    def origin(self):
+        '''
+        In-plane position of the first slice and its z, patient (LPS) coordinates.
+        '''
+        ipp=self.dicoms[0]['dataset'].ImagePositionPatient
+        return np.array([float(ipp[0]),float(ipp[1]),float(self.dicoms[0]['z'])])
+
+    @property
+    def orientation(self):
+        return np.array([float(v) for v in self.dicoms[0]['dataset'].ImageOrientationPatient])
+
+    def nbytes(self):
+        return 0 if self._voxels is None else self._voxels.nbytes
+
+    def read_datasets(self):
+        '''
+        Read complete datasets, including pixel data, in slice order. These are not cached and may be modified.
+        '''
+        return [pydicom.dcmread(f) for f in self.files]
+
+    def get_voxels(self):
+        '''
+        [column,row,slice] voxel array, read on first call. Do not modify it in place, it is shared.
+        '''
+        with self._lock:
+            if self._voxels is None:
+                print('reading pixel data of',len(self.dicoms),'DICOM files in',self.path)
+                ds=pydicom.dcmread(self.files[0])
+                voxels=np.zeros(self.shape,dtype=ds.pixel_array.dtype)
+                voxels[:,:,0]=np.transpose(ds.pixel_array)
+                for i,f in enumerate(self.files[1:]):
+                    voxels[:,:,i+1]=np.transpose(pydicom.dcmread(f).pixel_array)
+                self._voxels=voxels
+        if self._cache is not None: self._cache.evict()
+        return self._voxels
+
+class SeriesCache:
+    '''
+    LRU cache of DicomSeries keyed by (directory, mtime), bounded by the size of loaded voxel arrays.
+    The most recently used series is never evicted.
+    '''
+    def __init__(self,max_size_mb=None):
+        if max_size_mb is None:
+            max_size_mb=float(os.environ.get('PYMIPL_SERIES_CACHE_MB',1024))
+        self.max_size=int(max_size_mb*1024*1024)
+        self.entries=collections.OrderedDict()
+        self._lock=threading.RLock()
+
+    def get(self,path):
+        path=os.path.realpath(path)
+        key=(path,os.stat(path).st_mtime_ns)
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        series=DicomSeries(path)
+        if self.max_size<=0: return series
+        with self._lock:
+            for k in [k for k in self.entries if k[0]==path]: del self.entries[k]
+            self.entries[key]=series
+            series._cache=self
+        self.evict()
+        return series
+
+    def evict(self):
+        with self._lock:
+            total=sum([s.nbytes() for s in self.entries.values()])
+            while total>self.max_size and len(self.entries)>1:
+                key,series=self.entries.popitem(last=False)
+                series._cache=None
+                total-=series.nbytes()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+_series_cache=SeriesCache()
+
+def set_cache_size(max_size_mb:float):
+    '''
+    Change the memory budget of the series cache; 0 disables caching.
+    '''
+    _series_cache.max_size=int(max_size_mb*1024*1024)
+    if _series_cache.max_size<=0: _series_cache.clear()
+    else: _series_cache.evict()
+
+def load_series(path:str, cache:bool=True):
+    '''
+    Load the DICOM series in a directory, from the in-process cache if it is unchanged.
+    '''
+    return _series_cache.get(path) if cache else DicomSeries(path)
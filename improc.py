@@ -10,7 +10,7 @@ Redistribution and use in source and binary forms, for any purpose, with or with
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import numpy as np
+import numpy as np, itertools
 
         
 """
@@ -32,7 +32,7 @@ class Rect:
         xrb = min(max(a.xlt, a.xrb), max(b.xlt, b.xrb))
         yrb = min(max(a.ylt, a.yrb), max(b.ylt, b.yrb))
         if xlt<=xrb and ylt<=yrb:
-            return type(self)(xlt, ylt, xrb, yrb)   
+            return type(self)(vertices=[xlt, ylt, xrb, yrb])
     
     def wid(self):
         return self.xrb-self.xlt
@@ -92,7 +92,7 @@ class Rect:
             
     def union(self, other):
         a,b=self,other
-        return type(self) (verts=[min(a.xlt,b.xlt),min(a.ylt,b.ylt),max(a.xrb,b.xrb),max(a.yrb,b.yrb)])
+        return type(self) (vertices=[min(a.xlt,b.xlt),min(a.ylt,b.ylt),max(a.xrb,b.xrb),max(a.yrb,b.yrb)])
         
     def __init__(self, bounding_box=None, vertices=None, underlying_image=None):
         bb,verts,im=bounding_box,vertices,underlying_image
@@ -112,8 +112,8 @@ class Rect:
     #for a pt inside, return its quadrant.
     def quadrant(self,pt):
         c=self.ctr()
-        tl,tr=Rect(verts=[self.xlt,self.ylt,c[0],c[1]]),Rect(verts=[c[0],self.ylt,self.xrb,c[1]])
-        bl,br=Rect(verts=[self.xlt,c[1],c[0],self.yrb]),Rect(verts=[c[0],c[1],self.xrb,self.yrb])
+        tl,tr=Rect(vertices=[self.xlt,self.ylt,c[0],c[1]]),Rect(vertices=[c[0],self.ylt,self.xrb,c[1]])
+        bl,br=Rect(vertices=[self.xlt,c[1],c[0],self.yrb]),Rect(vertices=[c[0],c[1],self.xrb,self.yrb])
         if tl.pt_inside(pt): return 'lt'
         elif tr.pt_inside(pt): return 'rt'
         elif bl.pt_inside(pt): return 'lb'
@@ -136,3 +136,490 @@ class Rect:
         else:
             return False
 #end class Rect
+
+
+"""
+Arrays of rectangles
+"""
+class RectArray:
+    '''
+    N rectangles stored as one [N,4] array of (xlt, ylt, xrb, yrb), with vectorized Rect algebra.
+    '''
+    def __init__(self, boxes=None):
+        self.boxes=np.zeros((0,4)) if boxes is None else np.array(boxes,dtype=np.float64).reshape(-1,4)
+
+    @staticmethod
+    def from_rects(rects):
+        return RectArray([[r.xlt,r.ylt,r.xrb,r.yrb] for r in rects])
+
+    def to_rects(self):
+        return [Rect(vertices=b) for b in self.boxes.tolist()]
+
+    def __len__(self):
+        return self.boxes.shape[0]
+
+    def __getitem__(self, ind):
+        if np.isscalar(ind): return Rect(vertices=self.boxes[ind].tolist())
+        return RectArray(self.boxes[ind])
+
+    def __str__(self):
+        return "RectArray, {} rectangles".format(len(self))
+
+    def normalized(self):
+        '''
+        Boxes with left <= right and top <= bottom.
+        '''
+        b=self.boxes
+        return np.stack([np.minimum(b[:,0],b[:,2]),np.minimum(b[:,1],b[:,3]),
+                         np.maximum(b[:,0],b[:,2]),np.maximum(b[:,1],b[:,3])],axis=1)
+
+    def wid(self):
+        return self.boxes[:,2]-self.boxes[:,0]
+    def ht(self):
+        return self.boxes[:,3]-self.boxes[:,1]
+    def ctr(self):
+        return np.stack([self.boxes[:,0]+self.wid()*.5,self.boxes[:,1]+self.ht()*.5],axis=1)
+    def area(self):
+        return self.wid()*self.ht()
+
+    def pt_inside(self, pt):
+        b=self.boxes
+        return (pt[0]>b[:,0])&(pt[0]<b[:,2])&(pt[1]>b[:,1])&(pt[1]<b[:,3])
+
+    def _intersection_boxes(self, other, pairwise:bool):
+        a,b=self.normalized(),other.normalized()
+        if pairwise: a,b=a[:,None,:],b[None,:,:]
+        lt=np.maximum(a[...,:2],b[...,:2])
+        rb=np.minimum(a[...,2:],b[...,2:])
+        return np.concatenate([lt,rb],axis=-1)
+
+    def intersection(self, other):
+        '''
+        Element-wise intersection with another RectArray of the same length (or one box).
+        Returns the intersections and a mask of pairs that intersect (Rect.intersection is not None).
+        '''
+        c=self._intersection_boxes(other,False)
+        return RectArray(c),(c[:,0]<=c[:,2])&(c[:,1]<=c[:,3])
+
+    def union(self, other):
+        '''
+        Element-wise union with another RectArray of the same length (or one box).
+        '''
+        a,b=self.boxes,other.boxes
+        return RectArray(np.concatenate([np.minimum(a[:,:2],b[:,:2]),np.maximum(a[:,2:],b[:,2:])],axis=1))
+
+    def union_all(self):
+        '''
+        Bounding rectangle of all boxes, as Rect.union_list.
+        '''
+        if len(self)<1: return None
+        b=self.boxes
+        return Rect(vertices=[b[:,0].min().item(),b[:,1].min().item(),b[:,2].max().item(),b[:,3].max().item()])
+
+    def intersection_area_matrix(self, other):
+        c=self._intersection_boxes(other,True)
+        return np.clip(c[...,2]-c[...,0],0,None)*np.clip(c[...,3]-c[...,1],0,None)
+
+    def overlap_matrix(self, other):
+        '''
+        [N,M] matrix of Rect.overlaps for all pairs.
+        '''
+        c=self._intersection_boxes(other,True)
+        return (c[...,0]<c[...,2])&(c[...,1]<c[...,3])
+
+    def iou_matrix(self, other):
+        '''
+        [N,M] intersection over union for all pairs.
+        '''
+        inter=self.intersection_area_matrix(other)
+        union=np.abs(self.area())[:,None]+np.abs(other.area())[None,:]-inter
+        return np.divide(inter,union,out=np.zeros_like(inter),where=union>0)
+
+    def significant_intersection_matrix(self, other, ratio=0.5):
+        '''
+        [N,M] matrix of Rect.significant_intersection for all pairs.
+        '''
+        c=self._intersection_boxes(other,True)
+        s3=(c[...,2]-c[...,0])*(c[...,3]-c[...,1])
+        smin=np.minimum(self.area()[:,None],other.area()[None,:])
+        valid=(c[...,0]<=c[...,2])&(c[...,1]<=c[...,3])&(s3!=0)
+        return valid&(np.divide(smin,s3,out=np.zeros_like(s3),where=valid)>=ratio)
+
+    def expand(self, m):
+        self.boxes[:,:2]-=np.asarray(m)[:2]; self.boxes[:,2:]+=np.asarray(m)[:2]
+        return self
+
+    def adjust_to_size(self, sz):
+        '''
+        Resize all boxes to size sz=(wid,ht) around their centers, as Rect.adjust_to_size.
+        '''
+        sz0=np.asarray(sz)
+        x0,x1=self.boxes[:,:2],self.boxes[:,2:]
+        x0n=(x0-(sz0-(x1-x0))*.5).astype(int)
+        self.boxes=np.concatenate([x0n,x0n+sz0],axis=1).astype(np.float64)
+        return self
+
+    def clip(self, shape):
+        '''
+        Clip boxes to an image of the given shape (rows, columns).
+        '''
+        self.boxes[:,[0,2]]=np.clip(self.boxes[:,[0,2]],0,shape[1])
+        self.boxes[:,[1,3]]=np.clip(self.boxes[:,[1,3]],0,shape[0])
+        return self
+
+    def nms(self, scores, iou_threshold:float=0.5):
+        '''
+        Greedy non-maximum suppression. Returns indices of kept boxes by decreasing score.
+        '''
+        order=np.argsort(-np.asarray(scores),kind='stable')
+        boxes=self.normalized()
+        area=(boxes[:,2]-boxes[:,0])*(boxes[:,3]-boxes[:,1])
+        keep=[]
+        while order.shape[0]>0:
+            i=order[0]; keep+=[i]
+            rest=order[1:]
+            w=np.clip(np.minimum(boxes[i,2],boxes[rest,2])-np.maximum(boxes[i,0],boxes[rest,0]),0,None)
+            h=np.clip(np.minimum(boxes[i,3],boxes[rest,3])-np.maximum(boxes[i,1],boxes[rest,1]),0,None)
+            inter=w*h
+            union=area[i]+area[rest]-inter
+            iou=np.divide(inter,union,out=np.zeros_like(inter),where=union>0)
+            order=rest[iou<=iou_threshold]
+        return np.array(keep,dtype=np.int64)
+#end class RectArray
+
+"""
+Spatial index of rectangles
+"""
+class RectIndex:
+    '''
+    Uniform grid index over rectangles. Each box is registered in every grid cell it touches, so a query
+    only tests the boxes registered in the cells it touches. Box ids are positions in insertion order.
+    '''
+    def __init__(self, cell_size:float=32, rects=None):
+        self.cell_size=float(cell_size)
+        self.boxes=np.zeros((0,4))
+        self.alive=np.zeros(0,dtype=bool)
+        self.cells={}
+        if rects is not None: self.insert_many(rects)
+
+    @staticmethod
+    def _as_boxes(rects):
+        if isinstance(rects,RectArray): return rects.boxes
+        if isinstance(rects,Rect): return np.array([[rects.xlt,rects.ylt,rects.xrb,rects.yrb]],dtype=np.float64)
+        if len(rects)>0 and isinstance(rects[0],Rect): return RectArray.from_rects(rects).boxes
+        return np.array(rects,dtype=np.float64).reshape(-1,4)
+
+    def _cell_range(self, boxes):
+        nb=RectArray(boxes).normalized()
+        return np.floor(nb[:,:2]/self.cell_size).astype(np.int64),np.floor(nb[:,2:]/self.cell_size).astype(np.int64)
+
+    def _cells_of(self, boxes, ids):
+        '''
+        All (id, cell x, cell y) registrations of boxes.
+        '''
+        lo,hi=self._cell_range(boxes)
+        nx,ny=hi[:,0]-lo[:,0]+1,hi[:,1]-lo[:,1]+1
+        counts=nx*ny
+        rep=np.repeat(np.arange(boxes.shape[0]),counts)
+        local=np.arange(rep.shape[0])-np.repeat(np.cumsum(counts)-counts,counts)
+        return ids[rep],lo[rep,0]+local//ny[rep],lo[rep,1]+local%ny[rep]
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def insert_many(self, rects):
+        '''
+        Bulk load boxes (RectArray, list of Rect or [N,4] array). Returns their ids.
+        '''
+        boxes=self._as_boxes(rects)
+        ids=np.arange(self.boxes.shape[0],self.boxes.shape[0]+boxes.shape[0])
+        self.boxes=np.concatenate([self.boxes,boxes])
+        self.alive=np.concatenate([self.alive,np.ones(boxes.shape[0],dtype=bool)])
+        bid,cx,cy=self._cells_of(boxes,ids)
+        order=np.lexsort((cy,cx))
+        bid,cx,cy=bid[order],cx[order],cy[order]
+        starts=np.nonzero(np.r_[True,(cx[1:]!=cx[:-1])|(cy[1:]!=cy[:-1])])[0]
+        for seg,x,y in zip(np.split(bid,starts[1:]),cx[starts].tolist(),cy[starts].tolist()):
+            self.cells.setdefault((x,y),[]).extend(seg.tolist())
+        return ids
+
+    def insert(self, rect):
+        '''
+        Insert one box; returns its id.
+        '''
+        return int(self.insert_many(rect)[0])
+
+    def delete(self, id:int):
+        if not self.alive[id]: return
+        self.alive[id]=False
+        bid,cx,cy=self._cells_of(self.boxes[id:id+1],np.array([id]))
+        for x,y in zip(cx.tolist(),cy.tolist()):
+            cell=self.cells[(x,y)]
+            cell.remove(id)
+            if len(cell)==0: del self.cells[(x,y)]
+
+    def candidates(self, rect):
+        '''
+        Ids of live boxes registered in the grid cells touched by rect.
+        '''
+        lo,hi=self._cell_range(self._as_boxes(rect))
+        ids=[]
+        for x in range(lo[0,0],hi[0,0]+1):
+            for y in range(lo[0,1],hi[0,1]+1):
+                ids+=self.cells.get((x,y),[])
+        ids=np.unique(np.array(ids,dtype=np.int64))
+        return ids[self.alive[ids]]
+
+    def query_point(self, pt):
+        '''
+        Ids of boxes with pt inside (Rect.pt_inside).
+        '''
+        cand=self.candidates([pt[0],pt[1],pt[0],pt[1]])
+        return cand[RectArray(self.boxes[cand]).pt_inside(pt)]
+
+    def query_overlaps(self, rect):
+        '''
+        Ids of boxes that overlap rect (Rect.overlaps).
+        '''
+        q=RectArray(self._as_boxes(rect))
+        cand=self.candidates(q.boxes)
+        return cand[RectArray(self.boxes[cand]).overlap_matrix(q)[:,0]]
+
+    def query_significant_intersection(self, rect, ratio=0.5):
+        '''
+        Ids of boxes that significantly intersect rect (Rect.significant_intersection).
+        '''
+        q=RectArray(self._as_boxes(rect))
+        cand=self.candidates(q.boxes)
+        return cand[RectArray(self.boxes[cand]).significant_intersection_matrix(q,ratio)[:,0]]
+
+    def overlapping_pairs(self):
+        '''
+        All pairs (i<j) of live boxes that overlap, testing only boxes that share a grid cell.
+        '''
+        pairs=[]
+        for ids in self.cells.values():
+            if len(ids)<2: continue
+            ids=np.array(ids)
+            o=np.triu(RectArray(self.boxes[ids]).overlap_matrix(RectArray(self.boxes[ids])),1)
+            i,j=np.nonzero(o)
+            pairs+=[np.stack([ids[i],ids[j]],axis=1)]
+        if len(pairs)==0: return np.zeros((0,2),dtype=np.int64)
+        pairs=np.sort(np.concatenate(pairs),axis=1)
+        return np.unique(pairs,axis=0)
+#end class RectIndex
+
+"""
+3D box manipulation
+"""
+class Box3:
+    '''
+    Axis aligned 3D box [x0,x1) x [y0,y1) x [z0,z1) in array index order, with the Rect algebra.
+    '''
+    __slots__=('x0','y0','z0','x1','y1','z1')
+
+    def __init__(self, bounds=None, vertices=None, underlying_image=None):
+        '''
+        bounds: [[st,en],[st,en],[st,en]] as in subimage_convert; vertices: [x0,y0,z0,x1,y1,z1].
+        '''
+        self.x0=self.y0=self.z0=self.x1=self.y1=self.z1=0
+        if bounds is not None:
+            self.x0,self.y0,self.z0,self.x1,self.y1,self.z1=bounds[0][0],bounds[1][0],bounds[2][0],bounds[0][1],bounds[1][1],bounds[2][1]
+        if vertices is not None:
+            self.x0,self.y0,self.z0,self.x1,self.y1,self.z1=vertices[:6]
+        if underlying_image is not None:
+            self.x1,self.y1,self.z1=underlying_image.shape[:3]
+
+    def vertices(self):
+        return [self.x0,self.y0,self.z0,self.x1,self.y1,self.z1]
+    def bounds(self):
+        return [[self.x0,self.x1],[self.y0,self.y1],[self.z0,self.z1]]
+    def start(self):
+        return [self.x0,self.y0,self.z0]
+    def size(self):
+        return [self.x1-self.x0,self.y1-self.y0,self.z1-self.z0]
+    def ctr(self):
+        return [self.x0+(self.x1-self.x0)*.5,self.y0+(self.y1-self.y0)*.5,self.z0+(self.z1-self.z0)*.5]
+    def volume(self):
+        s=self.size()
+        return float(s[0])*s[1]*s[2]
+
+    def __str__(self):
+        return "Box3, size={}, ctr={}, bounds={}".format(self.size(),self.ctr(),self.bounds())
+
+    def _intersection_vertices(self, other):
+        a,b=self.vertices(),other.vertices()
+        lo=[max(min(a[i],a[i+3]),min(b[i],b[i+3])) for i in range(3)]
+        hi=[min(max(a[i],a[i+3]),max(b[i],b[i+3])) for i in range(3)]
+        return lo,hi
+
+    def overlaps(self, other):
+        lo,hi=self._intersection_vertices(other)
+        return all([lo[i]<hi[i] for i in range(3)])
+
+    def intersection(self, other):
+        lo,hi=self._intersection_vertices(other)
+        if all([lo[i]<=hi[i] for i in range(3)]):
+            return type(self)(vertices=lo+hi)
+
+    def union(self, other):
+        a,b=self.vertices(),other.vertices()
+        return type(self)(vertices=[min(a[i],b[i]) for i in range(3)]+[max(a[i],b[i]) for i in range(3,6)])
+
+    @staticmethod
+    def union_list(boxes):
+        if len(boxes)<1: return None
+        out=boxes[0]
+        for b in boxes[1:]:
+            out=out.union(b)
+        return out
+
+    def expand(self, m):
+        self.x0-=m[0]; self.x1+=m[0]
+        self.y0-=m[1]; self.y1+=m[1]
+        self.z0-=m[2]; self.z1+=m[2]
+
+    def adjust_to_size(self, sz):
+        '''
+        Resize around the center to sz voxels along each axis.
+        '''
+        sz0,x0,x1=np.array(sz),np.array(self.start()),np.array([self.x1,self.y1,self.z1])
+        d=(sz0-(x1-x0))*.5; x0n=(x0-d).astype(int); x1n=x0n+sz0
+        self.x0,self.y0,self.z0,self.x1,self.y1,self.z1=[int(v) for v in np.concatenate([x0n,x1n])]
+
+    def clip(self, shape):
+        '''
+        Clip to an image of the given shape.
+        '''
+        self.x0,self.x1=min(max(self.x0,0),shape[0]),min(max(self.x1,0),shape[0])
+        self.y0,self.y1=min(max(self.y0,0),shape[1]),min(max(self.y1,0),shape[1])
+        self.z0,self.z1=min(max(self.z0,0),shape[2]),min(max(self.z1,0),shape[2])
+
+    def pt_inside(self, pt):
+        return self.x0<pt[0]<self.x1 and self.y0<pt[1]<self.y1 and self.z0<pt[2]<self.z1
+
+    def significant_intersection(self, other, ratio=0.5):
+        c=self.intersection(other)
+        if c is None: return False
+        s3=c.volume()
+        return s3!=0 and min(self.volume(),other.volume())/s3>=ratio
+
+    def subimage(self, img):
+        b=type(self)(vertices=self.vertices())
+        b.clip(img.shape)
+        return img[int(b.x0):int(b.x1),int(b.y0):int(b.y1),int(b.z0):int(b.z1)]
+#end class Box3
+
+def box_starts(boxes):
+    '''
+    Integer start indices (array axis order) of a list of Box3 or Rect, or a RectArray.
+    Rect boxes index images as img[y,x], so their starts are (ylt, xlt).
+    '''
+    if isinstance(boxes,RectArray): return np.rint(boxes.boxes[:,[1,0]]).astype(np.int64)
+    if len(boxes)>0 and isinstance(boxes[0],Rect):
+        return np.rint(np.array([[b.ylt,b.xlt] for b in boxes],dtype=np.float64)).astype(np.int64)
+    return np.rint(np.array([b.start() for b in boxes],dtype=np.float64)).astype(np.int64).reshape(-1,3)
+
+def extract_boxes(img, starts, size, fill=0, out=None):
+    '''
+    Copy N equally sized boxes out of an array into one stacked output [N,*size,*trailing axes].
+    starts: [N,d] start indices along the first d=len(size) axes (see box_starts); parts of a box
+    outside of the image are set to fill. The output is allocated once, or can be passed as out.
+    '''
+    starts=np.asarray(starts,dtype=np.int64).reshape(-1,len(size))
+    size=np.asarray(size,dtype=np.int64)
+    d=size.shape[0]
+    shape=np.array(img.shape[:d])
+    if out is None:
+        out=np.empty((starts.shape[0],)+tuple(size)+img.shape[d:],dtype=img.dtype)
+    lo=np.clip(starts,0,shape); hi=np.clip(starts+size,0,shape)
+    inside=np.all((starts>=0)&(starts+size<=shape),axis=1)
+    for n in range(starts.shape[0]):
+        if inside[n]:
+            out[n]=img[tuple(slice(s,s+l) for s,l in zip(starts[n],size))]
+            continue
+        out[n]=fill
+        if np.any(hi[n]<=lo[n]): continue
+        src=tuple(slice(a,b) for a,b in zip(lo[n],hi[n]))
+        dst=tuple(slice(a-s,b-s) for a,b,s in zip(lo[n],hi[n],starts[n]))
+        out[n][dst]=img[src]
+    return out
+
+def box_ranges(boxes):
+    '''
+    Integer [lo,hi) index ranges (array axis order) of a RectArray, a list of Rect or Box3,
+    or an [N,2d] array of (lo..., hi...). Returns lo, hi as [N,d] arrays.
+    '''
+    if isinstance(boxes,RectArray):
+        b=boxes.normalized()[:,[1,0,3,2]]
+    elif len(boxes)>0 and isinstance(boxes[0],Rect):
+        b=RectArray.from_rects(boxes).normalized()[:,[1,0,3,2]]
+    elif len(boxes)>0 and isinstance(boxes[0],Box3):
+        b=np.array([bx.vertices() for bx in boxes],dtype=np.float64)
+    else:
+        b=np.array(boxes,dtype=np.float64)
+        b=b.reshape(b.shape[0] if b.ndim>1 else 1,-1)
+    b=np.rint(b).astype(np.int64)
+    d=b.shape[1]//2
+    return b[:,:d],b[:,d:]
+
+class IntegralImage:
+    '''
+    Summed-area tables of a 2D or 3D image: sum, mean, variance and nonzero count over
+    any number of boxes in O(1) per box. Boxes are clipped to the image.
+    '''
+    def __init__(self, img):
+        img=np.asarray(img)
+        self.shape=img.shape
+        self.sum_table=self._table(img.astype(np.float64))
+        self.sq_table=self._table(np.square(img,dtype=np.float64))
+        self.nz_table=self._table((img!=0).astype(np.int64))
+
+    @staticmethod
+    def _table(img):
+        t=np.zeros(tuple(s+1 for s in img.shape),dtype=img.dtype)
+        c=img
+        for ax in range(img.ndim): c=np.cumsum(c,axis=ax)
+        t[tuple(slice(1,None) for s in img.shape)]=c
+        return t
+
+    def _clip(self, boxes):
+        lo,hi=box_ranges(boxes)
+        shape=np.array(self.shape)
+        lo=np.clip(lo,0,shape); hi=np.clip(hi,0,shape)
+        return lo,np.maximum(hi,lo)
+
+    def _box_sum(self, table, lo, hi):
+        d=lo.shape[1]
+        out=np.zeros(lo.shape[0],dtype=table.dtype)
+        for corner in itertools.product([0,1],repeat=d):
+            idx=np.where(np.array(corner,dtype=bool),hi,lo)
+            sign=-1 if (d-sum(corner))%2 else 1
+            out+=sign*table[tuple(idx.T)]
+        return out
+
+    def count(self, boxes):
+        '''
+        Number of image elements in each (clipped) box.
+        '''
+        lo,hi=self._clip(boxes)
+        return np.prod(hi-lo,axis=1)
+
+    def sum(self, boxes):
+        lo,hi=self._clip(boxes)
+        return self._box_sum(self.sum_table,lo,hi)
+
+    def nonzero(self, boxes):
+        lo,hi=self._clip(boxes)
+        return self._box_sum(self.nz_table,lo,hi)
+
+    def mean(self, boxes):
+        n=self.count(boxes)
+        return np.divide(self.sum(boxes),n,out=np.zeros(n.shape[0]),where=n>0)
+
+    def var(self, boxes):
+        n=self.count(boxes)
+        lo,hi=self._clip(boxes)
+        s,s2=self._box_sum(self.sum_table,lo,hi),self._box_sum(self.sq_table,lo,hi)
+        m=np.divide(s,n,out=np.zeros(n.shape[0]),where=n>0)
+        return np.clip(np.divide(s2,n,out=np.zeros(n.shape[0]),where=n>0)-m*m,0,None)
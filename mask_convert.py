@@ -12,30 +12,59 @@ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
 
 
 import sys, nibabel as nib, numpy as np, argparse, sys
-from utils import write_rec_file
+from utils import write_rec_file, job_signature, job_params, up_to_date, add_incremental_args
 
-def split_masks(files, targs, outfile):
+def label_dtype(targets):
+    '''
+    Smallest integer type that holds 0 and all target values.
+    '''
+    return np.result_type(np.min_scalar_type(min(min(targets),0)),np.min_scalar_type(max(max(targets),0)))
+
+def merge_masks(files, targets, outfile, priority=None, slab_size:int=32):
+    '''
+    Merge any number of masks into one label map; voxels > 0 in files[i] get targets[i].
+    Overlaps go to the target listed first in priority, or to the last mask if priority is None.
+    Matching z-slabs are read from each input in turn, so memory does not grow with the number of masks.
+    '''
     try:
-        img1=nib.load(files[0])
-        img2=nib.load(files[1])
-        t1,t2=int(targs[0]),int(targs[1])        
+        imgs=[nib.load(f) for f in files]
+        targets=[int(t) for t in targets]
     except:
         print('ERROR: cannot read input file(s)')
         return False
-    if img1.shape != img2.shape: 
+    if len(set([img.shape for img in imgs]))>1:
         print('Dimensions of input images don\'t match.')
         return False
-    msk1,msk2=np.where(img1.get_fdata()>0,1,0)*t1,np.where(img2.get_fdata()>0,1,0)*t2
-    msk3=np.multiply(msk1,np.where(msk2==0,1,0))+msk2
+    if priority is not None:
+        priority=[int(t) for t in priority]
+        if len(set(targets))<len(targets) or sorted(priority)!=sorted(targets):
+            print('ERROR: priority must list every target value once')
+            return False
+        order=[targets.index(t) for t in priority[::-1]]
+    else:
+        order=list(range(len(files)))
+    
+    shape=imgs[0].shape
+    out=np.zeros(shape,dtype=label_dtype(targets))
+    nz=shape[2] if len(shape)>2 else 1
+    for z0 in range(0,nz,slab_size):
+        sl=(slice(None),slice(None),slice(z0,min(z0+slab_size,nz)))[:len(shape)]
+        for i in order:
+            out[sl][np.asanyarray(imgs[i].dataobj[sl])>0]=targets[i]
     
-    img3=nib.Nifti1Image(msk3,img1.affine,header=img1.header)
+    img=nib.Nifti1Image(out,imgs[0].affine,header=imgs[0].header)
+    img.set_data_dtype(out.dtype)
+    img.header.set_slope_inter(1,0)
     try:
-        nib.save(img3,outfile)
+        nib.save(img,outfile)
     except:
         print('ERROR: cannot write output file')
-        print(sys.last_traceback)
+        print(sys.exc_info()[1])
         return False
-    return True    
+    return True
+
+def split_masks(files, targs, outfile):
+    return merge_masks(files,targs,outfile)
     
 class DefParser(argparse.ArgumentParser):
     def error(self, message):
@@ -44,14 +73,21 @@ class DefParser(argparse.ArgumentParser):
         sys.exit(2)
         
 if __name__=="__main__":
-    p=DefParser(description='Convert two masks to a multi-mask')
-    p.add_argument('mask1',type=str,help='first mask')
-    p.add_argument('mask1_target',type=str,help='target value for mask1')    
-    p.add_argument('mask2',type=str,help='second mask')
-    p.add_argument('mask2_target',type=str,help='target value for mask2')
-    p.add_argument('outfile',type=str,help='output mask')    
+    p=DefParser(description='Convert masks to a multi-mask')
+    p.add_argument('masks',type=str,nargs='+',help='mask1 mask1_target [mask2 mask2_target ...] outfile')
+    p.add_argument('--priority',metavar='<string>',type=str,default=None,
+                   help='comma separated target values from highest to lowest overlap priority [last mask wins]')
+    p.add_argument('--slab_size',metavar='<int>',type=int,default=32,help='number of z planes read at a time [32]')
+    add_incremental_args(p)
     a=p.parse_args()
-    print ('split_masks ',a.mask1,a.mask2,a.mask1_target,a.mask2_target,a.outfile)
-    write_rec_file(outfile,'nii',[a.mask1,a.mask2])
-    sys.exit(split_masks([a.mask1,a.mask2],[a.mask1_target,a.mask2_target],a.outfile))
-    
+    if len(a.masks)<3 or len(a.masks)%2==0: p.error('expected mask/target pairs followed by an output file')
+    files,targets,outfile=a.masks[:-1:2],a.masks[1:-1:2],a.masks[-1]
+    priority=None if a.priority is None else a.priority.split(',')
+    sig=job_signature(files,job_params('mask_convert',a,['incremental','hash','slab_size']),a.hash)
+    if a.incremental and up_to_date(outfile,sig,files,'nii'):
+        print(outfile,'is up to date')
+        sys.exit(0)
+    print ('merge_masks ',files,targets,outfile)
+    ok=merge_masks(files,targets,outfile,priority,a.slab_size)
+    if ok: write_rec_file(outfile,'nii',files,sig)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,226 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import argparse, os, numpy as np, meshio, pydicom
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from skimage import measure
+from nifti2rtss import create_rtss_dataset
+from dicom_series import load_series
+from mesh_numpy import merge_vertices
+from utils import write_rec_file
+
+'''
+Convert closed triangle meshes to RTSTRUCT by intersecting them with the slice planes of the
+reference DICOM series, without rasterizing. Each intersection segment joins two mesh edges,
+so segments are chained into polygons through shared edges rather than by point matching.
+'''
+
+ROI_COLORS=[[0,230,0],[230,0,0],[0,0,230],[230,230,0],[0,230,230],[230,0,230],[255,128,0],[128,0,255]]
+
+def read_mesh(infile:str, lps:bool=False):
+    '''
+    Read a triangle mesh with meshio; points are converted to DICOM patient (LPS) coordinates
+    unless they already are (lps=True). Coincident points are welded.
+    '''
+    m=meshio.read(infile)
+    triangles=np.concatenate([c.data for c in m.cells if c.type=='triangle'])
+    points=np.asarray(m.points,dtype=np.float64)[:,:3].copy()
+    if not lps: points[:,:2]*=-1
+    return merge_vertices(points,triangles,1e-4)
+
+def get_slice_planes(dicoms_sorted):
+    '''
+    Unit row, column and normal directions of the series and the offset of each slice plane along the normal.
+    Returns (row, col, normal, offsets, slice order by offset).
+    '''
+    ds=dicoms_sorted[0]['dataset']
+    iop=np.array(ds.ImageOrientationPatient,dtype=np.float64)
+    row,col=iop[:3]/np.linalg.norm(iop[:3]),iop[3:]/np.linalg.norm(iop[3:])
+    normal=np.cross(row,col)
+    offsets=np.array([np.dot(normal,np.array(d['dataset'].ImagePositionPatient,dtype=np.float64)) for d in dicoms_sorted])
+    order=np.argsort(offsets,kind='stable')
+    return row,col,normal,offsets[order],order
+
+def slice_mesh(points, triangles, normal, offsets):
+    '''
+    Intersect a mesh with the planes normal.x=offsets[s] (offsets ascending).
+    A vertex counts as above a plane if strictly above it. Every crossing triangle gives one segment,
+    directed from the edge where the winding goes up through the plane to the edge where it goes down,
+    so on a consistently wound mesh each edge crossing starts one segment and ends another.
+    Returns slice index, start/end node keys and start points of all segments.
+    '''
+    h=points@normal
+    ht=h[triangles]
+    s0=np.searchsorted(offsets,ht.min(axis=1),'left')
+    s1=np.searchsorted(offsets,ht.max(axis=1),'left')
+    counts=s1-s0
+    t=np.repeat(np.arange(triangles.shape[0]),counts)
+    s=s0[t]+np.arange(t.shape[0])-np.repeat(np.cumsum(counts)-counts,counts)
+    
+    above=ht[t]>offsets[s][:,None]
+    nxt=[1,2,0]
+    up=np.argmax(~above & above[:,nxt],axis=1)
+    down=np.argmax(above & ~above[:,nxt],axis=1)
+    rows=np.arange(t.shape[0])
+    
+    def edge_crossing(j):
+        a,b=triangles[t,j],triangles[t,np.take(nxt,j)]
+        w=((offsets[s]-h[a])/(h[b]-h[a]))[:,None]
+        n=np.int64(points.shape[0])
+        key=(s.astype(np.int64)*n+np.minimum(a,b))*n+np.maximum(a,b)
+        return key,points[a]+w*(points[b]-points[a])
+    key_up,pt_up=edge_crossing(up)
+    key_down,_=edge_crossing(down)
+    return s,key_up,key_down,pt_up
+
+def chain_segments(key_start, key_end):
+    '''
+    Order directed segments into closed polygons with pointer jumping.
+    Returns node ids of segment starts in polygon order, and the polygon id of each;
+    segments on open chains (holes or inconsistent winding in the mesh) are dropped.
+    '''
+    keys,inv=np.unique(np.concatenate([key_start,key_end]),return_inverse=True)
+    n=keys.shape[0]; m=key_start.shape[0]
+    src,dst=inv[:m],inv[m:]
+    succ=np.arange(n); succ[src]=dst
+    valid=(np.bincount(src,minlength=n)==1)&(np.bincount(dst,minlength=n)==1)
+    nsteps=int(np.ceil(np.log2(max(n,2))))+1
+    
+    #nodes that reach an invalid node are on open chains.
+    bad,jump=~valid,succ.copy()
+    for i in range(nsteps):
+        bad|=bad[jump]; jump=jump[jump]
+    if np.any(bad): print('WARNING: dropping {} segments on open contours'.format(int(bad.sum())))
+    
+    #polygon id: smallest node id on the cycle.
+    cid,jump=np.arange(n),succ.copy()
+    for i in range(nsteps):
+        cid=np.minimum(cid,cid[jump]); jump=jump[jump]
+    
+    #break each cycle before its smallest node and rank nodes by distance to the break.
+    tail=succ==cid
+    rank=np.where(tail,0,1); jump=np.where(tail,np.arange(n),succ)
+    for i in range(nsteps):
+        rank=rank+rank[jump]; jump=jump[jump]
+    
+    nodes=np.nonzero(~bad)[0]
+    nodes=nodes[np.lexsort((-rank[nodes],cid[nodes]))]
+    return nodes,cid[nodes],src
+
+def mesh_to_contours(points, triangles, dicoms_sorted, tolerance:float=0, min_poly_pts:int=3):
+    '''
+    Planar contours of a mesh on every slice of a sorted DICOM series.
+    Returns a dict slice index (into dicoms_sorted) -> list of flat [x,y,z,...] contour coordinates.
+    '''
+    row,col,normal,offsets,order=get_slice_planes(dicoms_sorted)
+    s,key_up,key_down,pt_up=slice_mesh(points,triangles,normal,offsets)
+    if s.shape[0]==0: return {}
+    nodes,poly,src=chain_segments(key_up,key_down)
+    
+    node_pt=np.zeros((src.max()+1 if src.shape[0] else 0,3)); node_pt[src]=pt_up
+    node_slice=np.zeros(node_pt.shape[0],dtype=np.int64); node_slice[src]=s
+    splits=np.nonzero(np.diff(poly))[0]+1
+    contours={}
+    for pnodes in np.split(nodes,splits):
+        pts=node_pt[pnodes]
+        if tolerance>0:
+            uv=np.stack([pts@row,pts@col],axis=1)
+            #close the ring so the first point is kept, then drop the repeated closing point
+            uv=measure.approximate_polygon(np.concatenate([uv,uv[:1]]),tolerance)[:-1]
+            pts=uv[:,:1]*row+uv[:,1:]*col+np.dot(pts[0],normal)*normal
+        if pts.shape[0]<min_poly_pts: continue
+        sl=int(order[node_slice[pnodes[0]]])
+        contours.setdefault(sl,[]).append(pts.ravel().tolist())
+    return contours
+
+def add_roi(rtds, roi_number:int, roi_name:str, color, contours, dicoms_sorted):
+    '''
+    Append one ROI with its planar contours to an RTSTRUCT dataset made by create_rtss_dataset.
+    '''
+    ds=dicoms_sorted[0]['dataset']
+    structure_set_roi = Dataset()
+    structure_set_roi.ROINumber = str(roi_number)
+    structure_set_roi.ReferencedFrameOfReferenceUID = ds.FrameOfReferenceUID
+    structure_set_roi.ROIName = roi_name
+    structure_set_roi.ROIGenerationAlgorithm = 'AUTOMATIC'
+    rtds.StructureSetROISequence.append(structure_set_roi)
+
+    roi_contour = Dataset()
+    roi_contour.ROIDisplayColor = color
+    roi_contour.ContourSequence = Sequence()
+    for sl in sorted(contours.keys()):
+        contour_image = Dataset()
+        contour_image.ReferencedSOPClassUID = ds.SOPClassUID
+        contour_image.ReferencedSOPInstanceUID = dicoms_sorted[sl]['dataset'].SOPInstanceUID
+        for coords in contours[sl]:
+            contour = Dataset()
+            contour.ContourImageSequence = Sequence([contour_image])
+            contour.ContourGeometricType = 'CLOSED_PLANAR'
+            contour.NumberOfContourPoints = len(coords)//3
+            contour.ContourData = coords
+            roi_contour.ContourSequence.append(contour)
+    roi_contour.ReferencedROINumber = roi_number
+    rtds.ROIContourSequence.append(roi_contour)
+
+    rtroi_observations = Dataset()
+    rtroi_observations.ObservationNumber = str(roi_number)
+    rtroi_observations.ReferencedROINumber = str(roi_number)
+    rtroi_observations.RTROIInterpretedType = 'ORGAN'
+    rtroi_observations.ROIInterpreter = ''
+    rtds.RTROIObservationsSequence.append(rtroi_observations)
+
+def mesh2rtss(mesh_files:list, input_dicom_path:str, output_dicom_path:str, structure_label:str='ROI1',
+              roi_names:list=None, lps:bool=False, tolerance:float=0, min_poly_pts:int=3):
+    '''
+    Write an RTSTRUCT with one ROI per mesh file, referencing the DICOM series in input_dicom_path.
+    '''
+    dicomsSorted=load_series(input_dicom_path).dicoms
+    roi_names=[os.path.basename(f).rsplit('.',1)[0] for f in mesh_files] if roi_names is None else roi_names
+
+    rtds=create_rtss_dataset(dicomsSorted,structure_label)
+    rtds.ROIContourSequence = Sequence()
+    rtds.RTROIObservationsSequence = Sequence()
+    for i,f in enumerate(mesh_files):
+        print('Reading mesh',f)
+        points,triangles=read_mesh(f,lps)
+        contours=mesh_to_contours(points,triangles,dicomsSorted,tolerance,min_poly_pts)
+        print('ROI {}: {} contours on {} slices'.format(roi_names[i],sum([len(c) for c in contours.values()]),len(contours)))
+        add_roi(rtds,i+1,roi_names[i],ROI_COLORS[i%len(ROI_COLORS)],contours,dicomsSorted)
+
+    rtds.ApprovalStatus='UNAPPROVED'
+    pydicom.filewriter.dcmwrite(output_dicom_path,rtds,write_like_original=False)
+    print('RTSTRUCT saved as %s'%output_dicom_path)
+
+def get_parser():
+    """
+    Parse input arguments.
+    """
+    parser = argparse.ArgumentParser(description='Convert closed surface meshes to RTSTRUCT file by slicing them with the DICOM slice planes')
+
+    # Positional arguments.
+    parser.add_argument("input_mesh", nargs='+', help="Input mesh file(s), one ROI per file")
+    parser.add_argument("input_dicom", help="Path to input DICOM images")
+    parser.add_argument("output_dicom", help="Path to output DICOM image")
+    parser.add_argument("--structure_label",metavar="<string>",type=str,default="ROI1",help='structure set label [ROI1]')
+    parser.add_argument("--roi_names",metavar="<string>",type=str,default=None,help='comma separated ROI names [mesh file names]')
+    parser.add_argument("--lps", action="store_true", default=False,
+                        help="mesh coordinates are DICOM patient (LPS) coordinates, otherwise NIFTI world (RAS) [False]")
+    parser.add_argument("--tolerance",metavar="<float>", type=float, default=0,help="polygon approximation tolerance (mm), 0 to keep all points [0]")
+    parser.add_argument("--min_poly_pts", metavar="<int>",type=int,default=3,help="minimum number of points in polygon [3]")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    p = get_parser()
+    roi_names=None if p.roi_names is None else p.roi_names.split(',')
+    mesh2rtss(p.input_mesh,p.input_dicom,p.output_dicom,p.structure_label,roi_names,p.lps,p.tolerance,p.min_poly_pts)
+    write_rec_file(p.output_dicom,infiles=[p.input_dicom]+p.input_mesh)
@@ -0,0 +1,156 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import sys, time, argparse, subprocess, numpy as np, scipy.sparse, scipy.ndimage, nibabel as nib
+from skimage import measure
+
+'''
+VTK-free meshing backend for nifti2mesh: marching cubes from scikit-image and Taubin smoothing.
+Points are in the same coordinates as the VTK path (voxel index * voxel size, origin 0),
+use image_points_to_world to map them to the NIfTI affine.
+'''
+
+def image_points_to_world(points, affine):
+    '''
+    Map mesh points from image coordinates (voxel index * spacing) to world coordinates.
+    '''
+    spacing=nib.affines.voxel_sizes(affine)
+    return nib.affines.apply_affine(affine,points/spacing)
+
+def merge_vertices(points, triangles, tol):
+    '''
+    Merge vertices closer than tol and drop triangles that become degenerate.
+    '''
+    q=np.round(points/tol).astype(np.int64)
+    _,first,inv=np.unique(q,axis=0,return_index=True,return_inverse=True)
+    triangles=inv.ravel()[triangles]
+    keep=(triangles[:,0]!=triangles[:,1])&(triangles[:,1]!=triangles[:,2])&(triangles[:,0]!=triangles[:,2])
+    return points[first],triangles[keep]
+
+def extract_mesh(voxels, spacing, isovalue:float):
+    '''
+    Run marching cubes on a 3D array. Voxels with value >= isovalue are inside,
+    as in vtkContourFilter, triangles are wound with outward normals and coincident vertices are merged.
+    '''
+    vol=np.asarray(voxels,dtype=np.float32)
+    if vol.size==0 or vol.max()<isovalue or vol.min()>=isovalue:
+        return np.zeros((0,3),dtype=np.float32),np.zeros((0,3),dtype=np.int64)
+    eps=1e-6*max(float(vol.max()-vol.min()),1.0)
+    points,triangles,_,_=measure.marching_cubes(vol,isovalue-eps,spacing=tuple(float(s) for s in spacing),gradient_direction='ascent')
+    return merge_vertices(points,triangles,1e-4*float(np.min(spacing)))
+
+def smoothen_mesh(points, triangles, iterations:int=10, lam:float=0.5, mu:float=-0.53):
+    '''
+    Taubin (lambda/mu) smoothing with uniform Laplacian weights; does not shrink the mesh.
+    '''
+    n=points.shape[0]
+    if n==0: return points
+    edges=np.vstack([triangles[:,[0,1]],triangles[:,[1,2]],triangles[:,[2,0]]])
+    adj=scipy.sparse.coo_matrix((np.ones(edges.shape[0]),(edges[:,0],edges[:,1])),shape=(n,n)).tocsr()
+    adj=((adj+adj.T)>0).astype(np.float64)
+    deg=np.asarray(adj.sum(axis=1)).ravel()
+    deg[deg==0]=1
+    W=scipy.sparse.diags(1.0/deg) @ adj
+    pts=points.astype(np.float64)
+    for i in range(iterations):
+        pts=pts+lam*(W @ pts-pts)
+        pts=pts+mu*(W @ pts-pts)
+    return pts.astype(points.dtype)
+
+def mesh_from_array(voxels, affine, isovalue:float=1, smoothing:bool=True, world_coordinates:bool=False):
+    '''
+    Mesh an in-memory volume. Returns points and triangles.
+    '''
+    if voxels.ndim==4: voxels=voxels[...,0]
+    points,triangles=extract_mesh(voxels,nib.affines.voxel_sizes(affine),isovalue)
+    if smoothing: points=smoothen_mesh(points,triangles)
+    if world_coordinates: points=image_points_to_world(points,affine)
+    return points,triangles
+
+def get_label_bounding_boxes(voxels,labels=None):
+    '''
+    Bounding boxes of all labels in one pass over the image.
+    Returns a dict label -> tuple of slices into voxels.
+    '''
+    lab=voxels.astype(np.int64) if voxels.dtype.kind not in 'iu' else voxels
+    objs=scipy.ndimage.find_objects(np.where(lab>0,lab,0))
+    boxes={ l+1:sl for l,sl in enumerate(objs) if sl is not None }
+    if labels is not None:
+        boxes={ l:boxes[l] for l in labels if l in boxes }
+    return boxes
+
+def extract_label_meshes(voxels, affine, labels=None, isovalue:float=1, smoothing:bool=True):
+    '''
+    Mesh every label of a label map on its bounding box. Returns a dict label -> (points, triangles).
+    '''
+    if voxels.ndim==4: voxels=voxels[...,0]
+    spacing=nib.affines.voxel_sizes(affine)
+    lab=voxels if voxels.dtype.kind in 'iu' else voxels.astype(np.int64)
+    boxes=get_label_bounding_boxes(lab,labels)
+    print('meshing {} labels'.format(len(boxes)))
+    meshes={}
+    for l,bb in boxes.items():
+        st=[max(bb[i].start-1,0) for i in range(3)]
+        en=[min(bb[i].stop+1,lab.shape[i]) for i in range(3)]
+        crop=(lab[st[0]:en[0],st[1]:en[1],st[2]:en[2]]==l).astype(np.uint8)
+        points,triangles=extract_mesh(crop,spacing,isovalue)
+        points=points+np.array(st)*spacing
+        if smoothing: points=smoothen_mesh(points,triangles)
+        meshes[l]=(points,triangles)
+    return meshes
+
+def import_time(module:str):
+    '''
+    Wall time of a fresh interpreter importing a module.
+    '''
+    t=time.time()
+    subprocess.run([sys.executable,'-c','import '+module],check=True)
+    return time.time()-t
+
+def benchmark(nifti_file:str, isovalue:float=1, repeats:int=3):
+    '''
+    Compare startup time, run time and mesh parity of the VTK and scikit-image backends.
+    '''
+    from scipy.spatial import cKDTree
+    print('startup: python {:.2f} s, import vtk {:.2f} s, import skimage.measure {:.2f} s'.format(
+        import_time('sys'),import_time('vtk'),import_time('skimage.measure')))
+    import nifti2mesh
+    img=nib.load(nifti_file)
+    voxels,affine=nifti2mesh.reader_orientation(img)
+    res={}
+    for name in ['vtk','skimage']:
+        times=[]
+        for r in range(repeats):
+            t=time.time()
+            if name=='vtk':
+                vtkPolys=nifti2mesh.extract_mesh_from_vtkImage(nifti2mesh.numpy_to_vtkImage(voxels,affine),isovalue)
+                raw=nifti2mesh.get_triangular_mesh_from_vtkPolyData(vtkPolys)
+                smooth=nifti2mesh.get_triangular_mesh_from_vtkPolyData(nifti2mesh.smoothen_mesh_vtkPolys(vtkPolys))
+            else:
+                raw=extract_mesh(voxels,nib.affines.voxel_sizes(affine),isovalue)
+                smooth=(smoothen_mesh(*raw),raw[1])
+            times+=[time.time()-t]
+        res[name]=(raw,smooth)
+        print('{:8s} run time {:.3f} s, {} points, {} triangles'.format(name,min(times),raw[0].shape[0],raw[1].shape[0]))
+    for stage,ind in [('marching cubes',0),('smoothed',1)]:
+        p1,t1=res['vtk'][ind]; p2,t2=res['skimage'][ind]
+        if p1.shape[0]==0 or p2.shape[0]==0: continue
+        d=np.concatenate([cKDTree(p1).query(p2)[0],cKDTree(p2).query(p1)[0]])
+        a1,a2=measure.mesh_surface_area(p1,t1),measure.mesh_surface_area(p2,t2)
+        print('{:15s} vertex distance mean {:.4f} max {:.4f} mm, area vtk {:.1f} skimage {:.1f} mm2'.format(stage,d.mean(),d.max(),a1,a2))
+
+if __name__=="__main__":
+    p=argparse.ArgumentParser(description='Benchmark the scikit-image meshing backend against VTK')
+    p.add_argument('in_nii_file',help='input NIFTI mask')
+    p.add_argument('--min_mask_value',metavar='<float>',type=float,default=1,help='isovalue [1]')
+    p.add_argument('--repeats',metavar='<int>',type=int,default=3,help='number of timed repeats [3]')
+    a=p.parse_args()
+    benchmark(a.in_nii_file,a.min_mask_value,a.repeats)
@@ -13,45 +13,9 @@ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
 import sys, os, pydicom, argparse
 import nibabel as nib
 import numpy as np
-import ipywidgets as ipw
+from dicom_series import load_series, sort_dcms_by_slice_pos, voxel_array_from_sorted_dicoms
 from utils import write_rec_file
 
-def sort_dcms_by_slice_pos(input_dicom_path,dcm_files,stop_before_pixels=True):
-    '''
-    Sort DICOMs from an input directory (assumed to contain a single study) according to slice position
-    Output: a sorted list of DICOM datasets
-    '''
-    dcmss=[]
-    for idx,dcm in enumerate(dcm_files):
-        ds = pydicom.dcmread(os.path.join(input_dicom_path,dcm), stop_before_pixels)
-        if idx==0:           
-            if 'ImagePositionPatient' in ds: sortTag='ImagePositionPatient'
-            elif 'SliceLocation' in ds: sortTag='SliceLocation'
-            else: return None
-        if not sortTag in ds: return None
-        if sortTag=='ImagePositionPatient': z=ds.ImagePositionPatient[2]
-        else: z=ds.SliceLocation
-        dcmss+=[dict(file=dcm,dataset=ds,z=z)]
-    return sorted(dcmss, key=lambda dcms: dcms['z'])
-
-def voxel_array_from_sorted_dicoms(dicomsSorted):
-    '''
-    extract the 3D voxel array from a list of sorted DICOM objects.
-    '''
-    ind=0
-    
-    if len(dicomsSorted) < 1: return None
-    ds0=dicomsSorted[0]['dataset']
-    
-    imwidth,imheight,imdepth=ds0.Rows,ds0.Columns,len(dicomsSorted)
-    pixeldata_type=ds0.pixel_array.dtype
-    voxels=np.zeros([imwidth,imheight,imdepth],dtype=pixeldata_type)
-    
-    for i in range(len(dicomsSorted)):
-        voxels[:,:,i]=np.transpose(dicomsSorted[i]['dataset'].pixel_array)
-        
-    return voxels
-
 def convert_nifti_to_dcm(input_dcm:str, input_nifti:str, output_dcm:str, newSeriesDescription:str,\
                          newSeriesInstanceUID:str,newSeriesNumber:int,flipX:bool,flipY:bool,flipZ:bool):
     '''
@@ -78,18 +42,17 @@ def convert_nifti_to_dcm(input_dcm:str, input_nifti:str, output_dcm:str, newSeri
     
     print("axes flips:", [[0,-1*flips[0,0]],[1,-1*flips[1,1]],[2,flips[2,2]]])
     
-    dcm_in_files=next(os.walk(input_dcm))[2]
-    numberOfDicomImages = len(dcm_in_files)     
-    
+    series=load_series(input_dcm)
+    numberOfDicomImages = len(series)
     
-    #get a list of DICOM datasets, one dataset per slice
-    dcm_in_sorted=sort_dcms_by_slice_pos(input_dcm,dcm_in_files,stop_before_pixels=False)
+    #get a list of DICOM datasets, one dataset per slice, to be modified and written out
+    dcm_in_sorted=[dict(file=d['file'],dataset=ds,z=d['z']) for d,ds in zip(series.dicoms,series.read_datasets())]
 
     ds0=dcm_in_sorted[0]['dataset']
     dcm_pixeldata_type=ds0.pixel_array.dtype
 
     #read voxel arrays
-    dcm_in_voxels=voxel_array_from_sorted_dicoms(dcm_in_sorted)
+    dcm_in_voxels=series.get_voxels()
     nii_in_voxels=nii.get_fdata().astype(ds0.pixel_array.dtype)
     if dcm_in_voxels.shape != nii_in_voxels.shape:
         print ('NIFTI and DICOM image shapes don\'t match!')
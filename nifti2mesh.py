@@ -10,34 +10,76 @@ Redistribution and use in source and binary forms, for any purpose, with or with
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import re, nibabel as nib, argparse, numpy as np, os, json
-from skimage import measure
-from PIL import Image,ImageDraw
-from nibabel.nifti1 import Nifti1Image,Nifti1Header
-import meshio, vtk
-from vtk.numpy_interface import dataset_adapter as dsa
-from utils import write_rec_file
+import nibabel as nib, argparse, numpy as np, os, time
+from concurrent.futures import ThreadPoolExecutor
+import meshio
+from utils import write_rec_file, LazyModule, module_available
+import mesh_numpy
+from mesh_numpy import image_points_to_world, get_label_bounding_boxes
+
+#vtk is imported on first use, so that the scikit-image backend starts without it.
+vtk=LazyModule('vtk')
+numpy_support=LazyModule('vtk.util.numpy_support')
 
 def get_triangular_mesh_from_vtkPolyData(polydata):
     '''
     Form a triangular mesh understood by meshio, converted from vtkPolyData object.
-    Returns arrays of points and polygon indices.
+    Returns arrays of points and polygon indices. Both are views of the vtk arrays (no copy).
     '''
-    
-    polys=dsa.WrapDataObject(polydata)
-    polys1=np.array(polys.Polygons)
-    indices=np.array(range(polys1.shape[0]))
+    cells=polydata.GetPolys()
+    offsets=numpy_support.vtk_to_numpy(cells.GetOffsetsArray())
     
     #check that all polygons are actually triangles.
-    poly_codes=polys1[ indices[indices % 4 == 0] ]
+    if offsets.shape[0]>1 and np.any(np.diff(offsets)!=3):
+        raise(ValueError('polydata contains non-triangular shapes!'))
+    
+    triangles=numpy_support.vtk_to_numpy(cells.GetConnectivityArray())
+    if polydata.GetPoints() is None:
+        points=np.zeros((0,3),dtype=np.float32)
+    else:
+        points=numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    return points,triangles.reshape(-1,3)
 
-    if poly_codes.shape[0] != poly_codes[poly_codes == 3].shape[0]:
-        raise(ValueError('polydata contains non-triangular shapes!'))    
+def numpy_to_vtkImage(voxels, affine=None):
+    '''
+    Wrap a 3D numpy volume indexed [i,j,k] as vtkImageData.
+    Voxel spacing is taken from the affine; the origin is 0, as in read_NIFTI_into_vtkImage.
+    No copy is made for Fortran-ordered arrays (e.g. nibabel arrays and memory maps); the
+    caller must keep voxels unchanged while the vtk image is in use.
+    '''
+    if voxels.ndim==4: voxels=voxels[...,0]
+    if voxels.ndim!=3: raise ValueError('Only 3D volumes are supported.')
+    if voxels.dtype==bool: voxels=voxels.view(np.uint8)
+    spacing=nib.affines.voxel_sizes(affine) if affine is not None else np.ones(3)
     
-    #extract triangle point indices
-    triangles=polys1[ indices[indices % 4 !=0] ]
-        
-    return np.array(polys.Points),np.reshape(triangles,[triangles.shape[0]//3,3])
+    img=vtk.vtkImageData()
+    img.SetDimensions(*voxels.shape)
+    img.SetSpacing(*[float(s) for s in spacing])
+    img.SetOrigin(0,0,0)
+    #VTK stores x fastest, i.e. Fortran order of the [i,j,k] array.
+    img.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(order='F'),deep=False))
+    return img
+
+def reader_orientation(nifti_image):
+    '''
+    Voxels and affine of a nibabel image in the orientation of vtkNIFTIImageReader, which reverses
+    the slice order of images with qfac=-1 (left-handed qform). The affine maps the flipped voxels.
+    '''
+    voxels=np.asanyarray(nifti_image.dataobj)
+    affine=nifti_image.affine
+    if nifti_image.header['pixdim'][0]<0:
+        voxels=voxels[:,:,::-1]
+        flip=np.diag([1.,1.,-1.,1.])
+        flip[2,3]=voxels.shape[2]-1
+        affine=affine @ flip
+    return voxels,affine
+
+def nifti_to_vtkImage(nifti_image):
+    '''
+    Wrap an in-memory nibabel image as vtkImageData without reading the file again,
+    oriented as by vtkNIFTIImageReader. Images with qfac=-1 are copied.
+    '''
+    return numpy_to_vtkImage(*reader_orientation(nifti_image))
 
 def read_NIFTI_into_vtkImage(file:str):
     '''
@@ -70,6 +112,134 @@ def smoothen_mesh_vtkPolys(vtkPolys):
     vtkSF.Update()
     return vtkSF.GetOutput() 
 
+def decimate_mesh_vtkPolys(vtkPolys, target_triangles:int=None, target_error:float=None):
+    '''
+    Reduce the number of triangles of a vtk mesh.
+    target_triangles: quadric decimation down to this number of triangles.
+    target_error: decimate while the surface moves by less than this distance (mm).
+    '''
+    ntri=vtkPolys.GetNumberOfPolys()
+    if target_triangles is not None:
+        if ntri<=target_triangles: return vtkPolys
+        vtkDF=vtk.vtkQuadricDecimation()
+        vtkDF.SetTargetReduction(1.0-float(target_triangles)/ntri)
+        vtkDF.VolumePreservationOn()
+    elif target_error is not None:
+        vtkDF=vtk.vtkDecimatePro()
+        vtkDF.SetTargetReduction(0.99)
+        vtkDF.PreserveTopologyOn()
+        vtkDF.SetErrorIsAbsolute(1)
+        vtkDF.SetAbsoluteError(target_error)
+    else:
+        return vtkPolys
+    vtkDF.SetInputData(vtkPolys)
+    vtkDF.Update()
+    return vtkDF.GetOutput()
+
+def log_stage(stage:str, t0:float, ntriangles:int=None):
+    '''
+    Print triangle count and elapsed time of a processing stage, return current time.
+    '''
+    t=time.time()
+    ntri='' if ntriangles is None else ', {} triangles'.format(ntriangles)
+    print('{}: {:.2f} s{}'.format(stage,t-t0,ntri))
+    return t
+
+def set_vtk_threads(nthreads:int):
+    '''
+    Enable VTK SMP threading for filters that support it.
+    '''
+    smp=vtk.vtkSMPTools
+    if smp.GetBackend()=='Sequential': smp.SetBackend('STDThread')
+    smp.Initialize(nthreads if nthreads is not None else 0)
+
+def vtkImage_to_numpy(vtkImage):
+    '''
+    View of the first scalar component of a vtkImageData as a numpy array indexed [z,y,x].
+    '''
+    dims=vtkImage.GetDimensions()
+    scalars=numpy_support.vtk_to_numpy(vtkImage.GetPointData().GetScalars())
+    if scalars.ndim>1: scalars=scalars[:,0]
+    return scalars.reshape(dims[2],dims[1],dims[0])
+
+def extract_label_mesh(vtkImage,voxels,label,bbox,isovalue:float,smoothing:bool,target_triangles:int=None,target_error:float=None):
+    '''
+    Binary mesh of one label, computed on the label's bounding box (padded by one voxel).
+    The cropped image keeps the extent of the full image, so the mesh is identical
+    to meshing the full-size binary mask of this label.
+    '''
+    ext0=vtkImage.GetExtent()
+    st=[max(bbox[i].start-1,0) for i in range(3)]
+    en=[min(bbox[i].stop+1,voxels.shape[i]) for i in range(3)]
+    crop=np.ascontiguousarray(voxels[st[0]:en[0],st[1]:en[1],st[2]:en[2]]==label).astype(np.uint8)
+    
+    img=vtk.vtkImageData()
+    img.SetSpacing(vtkImage.GetSpacing())
+    img.SetOrigin(vtkImage.GetOrigin())
+    img.SetExtent(ext0[0]+st[2],ext0[0]+en[2]-1,ext0[2]+st[1],ext0[2]+en[1]-1,ext0[4]+st[0],ext0[4]+en[0]-1)
+    img.GetPointData().SetScalars(numpy_support.numpy_to_vtk(crop.ravel(),deep=True,array_type=vtk.VTK_UNSIGNED_CHAR))
+    
+    polys=extract_mesh_from_vtkImage(img,isovalue)
+    polys=decimate_mesh_vtkPolys(polys,target_triangles,target_error)
+    if smoothing: polys=smoothen_mesh_vtkPolys(polys)
+    return get_triangular_mesh_from_vtkPolyData(polys)
+
+def extract_label_meshes(vtkImage,labels=None,isovalue:float=1,smoothing:bool=True,nthreads:int=None,
+                         target_triangles:int=None,target_error:float=None):
+    '''
+    Extract a surface for every label of a label map.
+    Bounding boxes are found in one pass; labels are meshed concurrently.
+    Returns a dict label -> (points, triangles).
+    '''
+    voxels=vtkImage_to_numpy(vtkImage)
+    boxes=get_label_bounding_boxes(voxels,labels)
+    print('meshing {} labels'.format(len(boxes)))
+    with ThreadPoolExecutor(nthreads) as ex:
+        futures={ l:ex.submit(extract_label_mesh,vtkImage,voxels,l,bb,isovalue,smoothing,target_triangles,target_error) for l,bb in boxes.items() }
+        return { l:f.result() for l,f in futures.items() }
+
+def combine_label_meshes(label_meshes):
+    '''
+    Merge per-label meshes into one meshio.Mesh with a 'label' cell array.
+    '''
+    points,triangles,labels,offset=[],[],[],0
+    for l,(pts,tri) in sorted(label_meshes.items()):
+        points+=[pts]; triangles+=[tri+offset]; labels+=[np.full(tri.shape[0],l,dtype=np.int32)]
+        offset+=pts.shape[0]
+    if len(points)<1: return meshio.Mesh(np.zeros((0,3)),[("triangle",np.zeros((0,3),dtype=int))])
+    return meshio.Mesh(np.vstack(points),[("triangle",np.vstack(triangles))],cell_data={'label':[np.concatenate(labels)]})
+
+def mesh_from_array(voxels, affine, isovalue:float=1, smoothing:bool=True, target_triangles:int=None,
+                    target_error:float=None, world_coordinates:bool=False):
+    '''
+    Mesh an in-memory volume. Returns a meshio.Mesh with points in vtk image coordinates
+    (as written by this script), or in world coordinates of the affine.
+    '''
+    vtkImage=numpy_to_vtkImage(voxels,affine)
+    vtkPolys=extract_mesh_from_vtkImage(vtkImage,isovalue)
+    vtkPolys=decimate_mesh_vtkPolys(vtkPolys,target_triangles,target_error)
+    if smoothing: vtkPolys=smoothen_mesh_vtkPolys(vtkPolys)
+    points,nodes=get_triangular_mesh_from_vtkPolyData(vtkPolys)
+    if world_coordinates: points=image_points_to_world(points,affine)
+    return meshio.Mesh(points,[("triangle",nodes)])
+
+def get_label_mesh_file(out_mesh_file:str,label:int):
+    root,ext=os.path.splitext(out_mesh_file)
+    return '{}_label{}{}'.format(root,label,ext)
+
+def write_mesh(out_mesh_file:str,mesh):
+    '''
+    Write a meshio mesh; STL files are written in binary format.
+    '''
+    if out_mesh_file.lower().endswith('.stl'):
+        meshio.write(out_mesh_file,mesh,binary=True)
+    else:
+        meshio.write(out_mesh_file,mesh)
+
+def get_lod_mesh_file(out_mesh_file:str,level:int):
+    root,ext=os.path.splitext(out_mesh_file)
+    return '{}_lod{}{}'.format(root,level,ext)
+
 def vtk_write_stl(vtkPolys, filename:str):
     '''
     test to write vtkPolys into stl file
@@ -94,21 +264,91 @@ def get_parser():
                         help="minimum isovalue to create surface [1]")
 
     parser.add_argument("--no_mesh_smoothing", action='store_true', default=False, help="do not smoothen the output mesh [False]")
+    parser.add_argument("--labels", metavar="<string>",type=str,default=None,
+                        help="treat input as a label map and mesh each label: 'all' or comma separated list of labels [None]")
+    parser.add_argument("--combined", action='store_true', default=False,
+                        help="with --labels, write one mesh with a 'label' cell array instead of one file per label [False]")
+    parser.add_argument("--threads", metavar="<int>",type=int,default=None, help="number of threads [all cores]")
+    parser.add_argument("--target_triangles", metavar="<int>",type=int,default=None,
+                        help="decimate the mesh down to this number of triangles before smoothing [None]")
+    parser.add_argument("--target_error", metavar="<float>",type=float,default=None,
+                        help="decimate the mesh while surface error stays below this distance in mm [None]")
+    parser.add_argument("--lod", metavar="<string>",type=str,default=None,
+                        help="comma separated triangle counts of additional levels of detail, written to <out_mesh_root>_lod<N>.<ext>; not with --labels [None]")
+    parser.add_argument("--backend", type=str, choices=['auto','vtk','skimage'], default='auto',
+                        help="meshing backend; skimage (marching cubes, Taubin smoothing) does not need VTK. auto: vtk if installed [auto]")
+    parser.add_argument("--world_coordinates", action='store_true', default=False,
+                        help="write mesh points in world coordinates of the NIFTI affine instead of voxel index * voxel size [False]")
     
     return parser.parse_args()
     
 if __name__ == "__main__":
     p = get_parser()
+    backend=p.backend if p.backend!='auto' else ('vtk' if module_available('vtk') else 'skimage')
+    if backend=='skimage' and (p.target_triangles is not None or p.target_error is not None or p.lod is not None):
+        print('ERROR: mesh decimation requires the vtk backend'); exit(-1)
+    if p.labels is not None and p.lod is not None:
+        print('ERROR: --lod is not supported with --labels'); exit(-1)
+    print('backend:',backend)
     
     print ('reading',p.in_nii_file)
-    vtkImage=read_NIFTI_into_vtkImage(p.in_nii_file)
-    vtkPolys=extract_mesh_from_vtkImage(vtkImage,p.min_mask_value)
-    vtkPolysSmoothed=vtkPolys if p.no_mesh_smoothing else smoothen_mesh_vtkPolys(vtkPolys)                  
-    points, nodes=get_triangular_mesh_from_vtkPolyData(vtkPolysSmoothed)
-    cells=[("triangle",nodes)]
-    mesh=meshio.Mesh(points,cells)
-    print('writing',p.out_mesh_file)
-    meshio.write(p.out_mesh_file,mesh)   
-    write_rec_file(p.out_mesh_file,infiles=[p.in_nii_file])
+    t=time.time()
+    nifti_image=nib.load(p.in_nii_file)
+    voxels,affine=reader_orientation(nifti_image)
+    if backend=='vtk':
+        set_vtk_threads(p.threads)
+        vtkImage=numpy_to_vtkImage(voxels,affine)
+    t=log_stage('read',t)
+    
+    if p.labels is not None:
+        labels=None if p.labels=='all' else [int(l) for l in p.labels.split(',')]
+        if backend=='vtk':
+            label_meshes=extract_label_meshes(vtkImage,labels,p.min_mask_value,not p.no_mesh_smoothing,p.threads,
+                                              p.target_triangles,p.target_error)
+        else:
+            label_meshes=mesh_numpy.extract_label_meshes(voxels,affine,labels,p.min_mask_value,not p.no_mesh_smoothing)
+        if p.world_coordinates:
+            label_meshes={ l:(image_points_to_world(pts,affine),tri) for l,(pts,tri) in label_meshes.items() }
+        t=log_stage('mesh {} labels'.format(len(label_meshes)),t)
+        if p.combined:
+            print('writing',p.out_mesh_file)
+            write_mesh(p.out_mesh_file,combine_label_meshes(label_meshes))
+            write_rec_file(p.out_mesh_file,infiles=[p.in_nii_file])
+        else:
+            for l,(points,nodes) in sorted(label_meshes.items()):
+                out=get_label_mesh_file(p.out_mesh_file,l)
+                print('writing',out)
+                write_mesh(out,meshio.Mesh(points,[("triangle",nodes)]))
+                write_rec_file(out,infiles=[p.in_nii_file])
+        t=log_stage('write',t)
+    elif backend=='skimage':
+        points,nodes=mesh_numpy.mesh_from_array(voxels,affine,p.min_mask_value,not p.no_mesh_smoothing,p.world_coordinates)
+        t=log_stage('mesh',t,nodes.shape[0])
+        print('writing',p.out_mesh_file)
+        write_mesh(p.out_mesh_file,meshio.Mesh(points,[("triangle",nodes)]))
+        write_rec_file(p.out_mesh_file,infiles=[p.in_nii_file])
+        t=log_stage('write',t)
+    else:
+        vtkPolys=extract_mesh_from_vtkImage(vtkImage,p.min_mask_value)
+        t=log_stage('contour',t,vtkPolys.GetNumberOfPolys())
+        
+        #main output, then optional levels of detail, each decimated from the previous level.
+        levels=[(p.out_mesh_file,p.target_triangles,p.target_error)]
+        if p.lod is not None:
+            levels+=[(get_lod_mesh_file(p.out_mesh_file,i+1),int(n),None) for i,n in enumerate(p.lod.split(','))]
+        
+        for out,target_triangles,target_error in levels:
+            vtkPolys=decimate_mesh_vtkPolys(vtkPolys,target_triangles,target_error)
+            t=log_stage('decimate',t,vtkPolys.GetNumberOfPolys())
+            vtkPolysSmoothed=vtkPolys if p.no_mesh_smoothing else smoothen_mesh_vtkPolys(vtkPolys)
+            t=log_stage('smooth',t,vtkPolysSmoothed.GetNumberOfPolys())
+            points, nodes=get_triangular_mesh_from_vtkPolyData(vtkPolysSmoothed)
+            if p.world_coordinates: points=image_points_to_world(points,affine)
+            cells=[("triangle",nodes)]
+            mesh=meshio.Mesh(points,cells)
+            print('writing',out)
+            write_mesh(out,mesh)
+            write_rec_file(out,infiles=[p.in_nii_file])
+            t=log_stage('write',t)
     print('done')
     
\ No newline at end of file
@@ -12,7 +12,7 @@ Redistribution and use in source and binary forms, for any purpose, with or with
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import random, nibabel as nib, argparse, numpy as np, os
+import sys, random, nibabel as nib, argparse, numpy as np, os
 from datetime import datetime
 
 from skimage import measure
@@ -21,7 +21,8 @@ import pydicom
 from pydicom.dataset import Dataset
 from pydicom.sequence import Sequence
 from pydicom.uid import generate_uid
-from utils import write_rec_file
+from dicom_series import load_series, sort_dcms_by_slice_pos
+from utils import write_rec_file, job_signature, job_params, up_to_date, add_incremental_args
 
 def concatenate_coordinates(coordinates_x, coordinates_y, coordinates_z):
 
@@ -34,22 +35,6 @@ def concatenate_coordinates(coordinates_x, coordinates_y, coordinates_z):
 
     return vector
 
-
-
-def sort_dcms_by_slice_pos(input_dicom_path,dcm_files):
-    dcmss=[]
-    for idx,dcm in enumerate(dcm_files):
-        ds = pydicom.dcmread(os.path.join(input_dicom_path,dcm), stop_before_pixels=True)
-        if idx==0:           
-           if 'ImagePositionPatient' in ds: sortTag='ImagePositionPatient'
-           elif 'SliceLocation' in ds: sortTag='SliceLocation'
-           else: return None
-        if not sortTag in ds: return None
-        if sortTag=='ImagePositionPatient': z=ds.ImagePositionPatient[2]
-        else: z=ds.SliceLocation
-        dcmss+=[dict(file=dcm,dataset=ds,z=z)]
-    return sorted(dcmss, key=lambda dcms: dcms['z'])
-
 def create_rtss_dataset(dicoms_sorted,structure_label):
     rf=dicoms_sorted[0]['dataset']
 
@@ -164,14 +149,13 @@ def convert(input_nifti_path: str, input_dicom_path: str, output_dicom_path: str
     # First DICOM part
     #---------------
 
-    # Get number of DICOM files in DICOM path
-    dicomFiles = next(os.walk(input_dicom_path))[2]
+    series=load_series(input_dicom_path)
 
-    numberOfDicomImages = len(dicomFiles)
+    numberOfDicomImages = len(series)
     numberOfROIs = 1   # The whole volume is 1 ROI, assuming 1 tumour per patient
     
     # Load template DICOM file header (first file)
-    dicomsSorted=sort_dcms_by_slice_pos(input_dicom_path,dicomFiles)
+    dicomsSorted=series.dicoms
 
     ds = dicomsSorted[0]['dataset']
     #ds.dir()
@@ -377,11 +361,17 @@ def get_parser():
     parser.add_argument("--structure_label",metavar="<string>",type=str,default="ROI1",help='structure set label [ROI1]')
     parser.add_argument("--tolerance",metavar="<float>", type=float, default=1,help="polygon approximation tolerance (mm) [1]")
     parser.add_argument("--min_poly_pts", metavar="<int>",type=int,default=3,help="minimum number of points in polygon [3]")
+    add_incremental_args(parser)
 
     return parser.parse_args()
 
 if __name__ == "__main__":
     p = get_parser()
     print(p)
+    infiles=[p.input_dicom,p.input_nifti]
+    sig=job_signature(infiles,job_params('nifti2rtss',p),p.hash)
+    if p.incremental and up_to_date(p.output_dicom,sig,infiles):
+        print(p.output_dicom,'is up to date')
+        sys.exit(0)
     convert(p.input_nifti, p.input_dicom, p.output_dicom, p.structure_label,p.tolerance,p.min_poly_pts)
-    write_rec_file(p.output_dicom,infiles=[p.input_dicom,p.input_nifti])
+    write_rec_file(p.output_dicom,infiles=infiles,signature=sig)
@@ -0,0 +1,168 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import sys, argparse, numpy as np, h5py
+from multiprocessing import Pool
+from subimage_convert import split_image, get_subimages
+from utils import write_rec_file
+
+'''
+Patch store layout (HDF5):
+/<cube_dim>/images            float32 [N,d,d,d], one chunk per patch
+/<cube_dim>/masks             uint8   [N,d,d,d], one chunk per patch
+/<cube_dim>/scaled_src_dims   int32   [N,3]
+/<cube_dim>/scaled_src_range  int32   [N,3,2]
+/<cube_dim>/targ_range        int32   [N,3,2]
+/<cube_dim>/image_file, roi_file   string [N]
+'''
+
+def extract_patch(job):
+    '''
+    Cut image and mask patches around one ROI. Runs in a worker process.
+    job: (image file, ROI mask file)
+    Returns a dict with patches and metadata, None if no patch can be cut,
+    or dict(error=message) if processing raised an exception.
+    '''
+    img_file,roi_file=job
+    try:
+        res=split_image(img_file,[roi_file])
+        if res is None: return None
+        im,masks,T=res
+        sub=get_subimages(im,masks[0],T)
+        if sub is None or len(sub)<3: return None
+        subim,submask,hdr=sub
+        return dict(image_file=img_file,roi_file=roi_file,
+                    image=np.asarray(subim.dataobj,dtype=np.float32),
+                    mask=np.asarray(submask.dataobj).astype(np.uint8),
+                    scaled_src_dims=hdr['scaled_src_dims'],
+                    scaled_src_range=hdr['scaled_src_range'],
+                    targ_range=hdr['targ_range'])
+    except Exception as e:
+        return dict(error='{}: {}'.format(type(e).__name__,e))
+
+def get_group(h5,cube_dim,compression):
+    '''
+    Get or create the resizable group for patches of a given cube size.
+    '''
+    name=str(cube_dim)
+    if name in h5: return h5[name]
+    g=h5.create_group(name)
+    shp=(cube_dim,cube_dim,cube_dim)
+    g.create_dataset('images',shape=(0,)+shp,maxshape=(None,)+shp,chunks=(1,)+shp,
+                     dtype=np.float32,compression=compression,shuffle=True)
+    g.create_dataset('masks',shape=(0,)+shp,maxshape=(None,)+shp,chunks=(1,)+shp,
+                     dtype=np.uint8,compression=compression,shuffle=True)
+    g.create_dataset('scaled_src_dims',shape=(0,3),maxshape=(None,3),dtype=np.int32)
+    g.create_dataset('scaled_src_range',shape=(0,3,2),maxshape=(None,3,2),dtype=np.int32)
+    g.create_dataset('targ_range',shape=(0,3,2),maxshape=(None,3,2),dtype=np.int32)
+    for key in ['image_file','roi_file']:
+        g.create_dataset(key,shape=(0,),maxshape=(None,),dtype=h5py.string_dtype())
+    g.attrs['cube_dim']=cube_dim
+    return g
+
+def append_patch(h5,patch,compression='gzip'):
+    '''
+    Append one patch returned by extract_patch to the store.
+    Returns (cube_dim, index) of the stored patch.
+    '''
+    cube_dim=patch['image'].shape[0]
+    g=get_group(h5,cube_dim,compression)
+    n=g['images'].shape[0]
+    for key in ['images','masks','scaled_src_dims','scaled_src_range','targ_range','image_file','roi_file']:
+        g[key].resize(n+1,axis=0)
+    g['images'][n]=patch['image']
+    g['masks'][n]=patch['mask']
+    for key in ['scaled_src_dims','scaled_src_range','targ_range','image_file','roi_file']:
+        g[key][n]=patch[key]
+    return cube_dim,n
+
+def export_patches(jobs,out_file,nworkers=4,compression='gzip'):
+    '''
+    Extract patches for a list of (image, ROI mask) pairs on a pool of workers and write
+    them into a single chunked HDF5 store. Only the calling process writes to the file.
+    Returns the number of stored patches.
+    '''
+    nstored=0
+    with h5py.File(out_file,'a') as h5, Pool(nworkers) as pool:
+        for job,patch in zip(jobs,pool.imap(extract_patch,jobs)):
+            if patch is None:
+                print('WARNING: cannot extract patch for',job)
+                continue
+            if 'error' in patch:
+                print('ERROR: cannot extract patch for',job,':',patch['error'])
+                continue
+            cube_dim,ind=append_patch(h5,patch,compression)
+            print('stored',job[1],'as',cube_dim,ind)
+            nstored+=1
+    return nstored
+
+class PatchStore:
+    '''
+    Random access reader for a patch store written by export_patches.
+    '''
+    def __init__(self,file):
+        self.h5=h5py.File(file,'r')
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def cube_dims(self):
+        return sorted([int(k) for k in self.h5.keys()])
+
+    def count(self,cube_dim):
+        return self.h5[str(cube_dim)]['images'].shape[0]
+
+    def get_patch(self,cube_dim,ind):
+        '''
+        Read one patch; returns image, mask and the header dict used by subimage2image.
+        '''
+        g=self.h5[str(cube_dim)]
+        hdr=dict(scaled_src_dims=g['scaled_src_dims'][ind].tolist(),
+                 scaled_src_range=g['scaled_src_range'][ind].tolist(),
+                 targ_range=g['targ_range'][ind].tolist())
+        return g['images'][ind],g['masks'][ind],hdr
+
+def read_job_list(file):
+    '''
+    Read a text file with one "<image> <roi mask>" pair per line.
+    '''
+    jobs=[]
+    with open(file,'r') as f:
+        for line in f:
+            tok=line.split()
+            if len(tok)<2 or tok[0].startswith('#'): continue
+            jobs+=[(tok[0],tok[1])]
+    return jobs
+
+class DefParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+if __name__=="__main__":
+    p=DefParser(description='Export image and ROI patches of many subjects into one chunked HDF5 store')
+    p.add_argument('job_list',type=str,help='text file, one "<image> <roi mask>" pair per line')
+    p.add_argument('out_h5',type=str,help='output HDF5 patch store (appended if exists)')
+    p.add_argument('--workers',metavar='<int>',type=int,default=4,help='number of worker processes [4]')
+    p.add_argument('--compression',metavar='<string>',type=str,default='gzip',help='HDF5 compression filter [gzip]')
+    a=p.parse_args()
+
+    jobs=read_job_list(a.job_list)
+    n=export_patches(jobs,a.out_h5,a.workers,a.compression)
+    print('stored {} out of {} patches'.format(n,len(jobs)))
+    write_rec_file(a.out_h5,infiles=[a.job_list])
@@ -0,0 +1,63 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import sys, os, runpy
+
+'''
+Single entry point for the pymipl tools: python pymipl.py <command> [arguments].
+Only the standard library is imported here; a command imports its tool module when it runs,
+so listing commands and light commands do not pay for pydicom, nibabel, scikit-image or VTK.
+'''
+
+COMMANDS=[
+    ('nifti2rtss','nifti2rtss','NIFTI mask to DICOM RTSTRUCT'),
+    ('mesh2rtss','mesh2rtss','surface meshes to DICOM RTSTRUCT'),
+    ('rtss2nifti','rtss2nifti','DICOM RTSTRUCT to NIFTI masks and structural image'),
+    ('rtss2mesh','rtss2mesh','DICOM RTSTRUCT ROIs to surface meshes'),
+    ('nifti2dcm','nifti2dcm','replace the voxels of a DICOM series with a NIFTI image'),
+    ('nifti2mesh','nifti2mesh','NIFTI mask or label map to surface meshes'),
+    ('stl2nifti','stl2nifti','STL meshes to a NIFTI mask or label map'),
+    ('subimage_convert','subimage_convert','ROI mask to cubic subimage and back'),
+    ('cc_maxp_mask','cc_maxp_mask','keep the most probable connected components of a mask'),
+    ('mask_convert','mask_convert','merge binary masks into a label map'),
+    ('convert_4dfp','convert_4dfp','4dfp to NIFTI and NIFTI to 4dfp'),
+    ('patch_export','patch_export','export image and ROI patches into an HDF5 store'),
+    ('dicom_sort','dicom_sort','index structural, RTSTRUCT and SEG DICOM series under a directory'),
+    ('daemon','pymipl_daemon','warm conversion daemon and its client'),
+]
+
+def print_usage(file=sys.stdout):
+    file.write('usage: pymipl.py [-h] <command> [arguments]\n\ncommands:\n')
+    for name,module,descr in COMMANDS:
+        file.write('  {:18s}{}\n'.format(name,descr))
+    file.write('\nrun "pymipl.py <command> -h" for the arguments of a command\n')
+
+def run_command(name:str, args:list):
+    '''
+    Run a command's tool module as __main__ with the given arguments.
+    '''
+    module=dict([(c[0],c[1]) for c in COMMANDS])[name]
+    sys.argv=[module+'.py']+list(args)
+    runpy.run_module(module,run_name='__main__',alter_sys=True)
+
+if __name__=="__main__":
+    sys.path.insert(0,os.path.dirname(os.path.realpath(__file__)))
+    if len(sys.argv)<2:
+        print_usage(sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] in ['-h','--help']:
+        print_usage()
+        sys.exit(0)
+    if sys.argv[1] not in [c[0] for c in COMMANDS]:
+        sys.stderr.write('error: unknown command {}\n'.format(sys.argv[1]))
+        print_usage(sys.stderr)
+        sys.exit(2)
+    run_command(sys.argv[1],sys.argv[2:])
@@ -0,0 +1,282 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import sys, os, io, json, time, socket, getpass, tempfile, argparse, threading
+from concurrent.futures.process import BrokenProcessPool
+from pymipl import COMMANDS
+
+'''
+Warm conversion daemon. "serve" imports the heavy modules once and runs tool command lines on a pool
+of long-lived worker processes listening on a local Unix socket; the other commands are a thin client
+that submits jobs and queries their status. Workers keep their in-process caches (e.g. DICOM series)
+between jobs. Socket path is taken from PYMIPL_SOCKET [<tmp>/pymipl-<user>.sock].
+
+Protocol: one JSON request line per connection, answered by one JSON line.
+    {"cmd":"submit","tool":..,"args":[..],"cwd":..}  -> {"id":..}
+    {"cmd":"status"[,"id":..]}, {"cmd":"wait","id":..}, {"cmd":"shutdown"}
+'''
+
+TOOLS=[c[1] for c in COMMANDS if c[1]!='pymipl_daemon']
+PRELOAD=['numpy','scipy.ndimage','nibabel','pydicom','cmdline_provenance','skimage.measure','PIL.Image','utils','dicom_series']+TOOLS
+MAX_FINISHED_JOBS=1000
+
+def default_socket():
+    return os.environ.get('PYMIPL_SOCKET',os.path.join(tempfile.gettempdir(),'pymipl-{}.sock'.format(getpass.getuser())))
+
+def preload(modules):
+    '''
+    Import modules before the workers are forked. Tools with missing dependencies are reported and skipped.
+    '''
+    import importlib
+    for m in modules:
+        t=time.time()
+        try:
+            importlib.import_module(m)
+            print('imported {} in {:.2f} s'.format(m,time.time()-t))
+        except Exception as e:
+            print('WARNING: cannot import {}: {}'.format(m,e))
+
+def run_tool(tool, args, cwd):
+    '''
+    Run a tool's command line in a worker process. Returns (exit code, captured output, start, end).
+    '''
+    import runpy, contextlib, traceback
+    start=time.time()
+    out=io.StringIO()
+    argv,wd=sys.argv,os.getcwd()
+    code=0
+    try:
+        os.chdir(cwd)
+        sys.argv=[tool+'.py']+list(args)
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            try:
+                runpy.run_module(tool,run_name='__main__',alter_sys=True)
+            except SystemExit as e:
+                code=e.code if isinstance(e.code,int) else (0 if e.code is None else 1)
+                if not isinstance(e.code,(int,type(None))): print(e.code)
+            except BaseException:
+                traceback.print_exc()
+                code=1
+    finally:
+        sys.argv=argv
+        os.chdir(wd)
+    return code,out.getvalue(),start,time.time()
+
+class Job:
+    def __init__(self,id,tool,args,cwd):
+        self.id,self.tool,self.args,self.cwd=id,tool,args,cwd
+        self.submitted=time.time()
+        self.future=None
+        self.result=None
+
+    def state(self):
+        if self.result is not None: return 'done' if self.result[0]==0 else 'failed'
+        return 'running' if self.future.running() else 'queued'
+
+    def info(self,output=False):
+        d=dict(id=self.id,tool=self.tool,args=self.args,cwd=self.cwd,state=self.state(),submitted=self.submitted)
+        if self.result is not None:
+            code,log,start,end=self.result
+            d.update(returncode=code,queued_s=start-self.submitted,run_s=end-start)
+            if output: d['output']=log
+        return d
+
+class Daemon:
+    '''
+    Job table and worker pool; requests are handled on one thread per connection.
+    '''
+    def __init__(self,workers:int=4):
+        self.workers=workers
+        self.pool=self.new_pool()
+        self.jobs={}
+        self.next_id=1
+        #reentrant: a done callback may run inside submit, which holds the lock
+        self.lock=threading.RLock()
+        self.stopping=False
+
+    def new_pool(self):
+        import multiprocessing, concurrent.futures
+        return concurrent.futures.ProcessPoolExecutor(self.workers,mp_context=multiprocessing.get_context('fork'))
+
+    def restart_pool(self,broken):
+        '''
+        Replace a pool that was broken by an abruptly terminated worker, unless that was already done.
+        '''
+        with self.lock:
+            if self.pool is not broken: return
+            print('WARNING: a worker process terminated abruptly, restarting the worker pool')
+            self.pool=self.new_pool()
+        broken.shutdown(wait=False)
+
+    def submit(self,tool,args,cwd):
+        if tool not in TOOLS: raise ValueError('unknown tool {}, expected one of {}'.format(tool,', '.join(TOOLS)))
+        with self.lock:
+            job=Job(self.next_id,tool,args,cwd)
+            #publish the job only once it has a future, so status/wait never see future=None
+            try:
+                job.future=self.pool.submit(run_tool,tool,args,cwd)
+            except BrokenProcessPool:
+                self.restart_pool(self.pool)
+                job.future=self.pool.submit(run_tool,tool,args,cwd)
+            pool=self.pool
+            job.future.add_done_callback(lambda f: self.finish(job,f,pool))
+            self.next_id+=1
+            self.jobs[job.id]=job
+            self.prune()
+        return job
+
+    def finish(self,job,future,pool):
+        try:
+            job.result=future.result()
+        except BrokenProcessPool:
+            now=time.time()
+            job.result=(1,'ERROR: a worker process terminated abruptly (crash or os._exit) while this job was queued or running; '
+                          'the worker pool was restarted, resubmit the job\n',now,now)
+            self.restart_pool(pool)
+        except Exception as e:
+            now=time.time()
+            job.result=(1,'ERROR: worker failed: {}\n'.format(e),now,now)
+        print('job {} {} {} in {:.2f} s'.format(job.id,job.tool,job.state(),job.result[3]-job.result[2]))
+
+    def prune(self):
+        finished=[id for id,j in self.jobs.items() if j.result is not None]
+        for id in finished[:max(0,len(finished)-MAX_FINISHED_JOBS)]: del self.jobs[id]
+
+    def get_job(self,id):
+        with self.lock:
+            if id not in self.jobs: raise ValueError('no job {}'.format(id))
+            return self.jobs[id]
+
+    def handle(self,req):
+        cmd=req.get('cmd')
+        if cmd=='submit':
+            return dict(id=self.submit(req['tool'],req.get('args',[]),req.get('cwd','.')).id)
+        if cmd=='status':
+            if 'id' in req: return self.get_job(req['id']).info(req.get('output',False))
+            with self.lock: jobs=list(self.jobs.values())
+            return dict(jobs=[j.info() for j in jobs])
+        if cmd=='wait':
+            job=self.get_job(req['id'])
+            job.future.exception()
+            while job.result is None: time.sleep(0.01)
+            return job.info(True)
+        if cmd=='shutdown':
+            self.stopping=True
+            return dict(ok=True)
+        raise ValueError('unknown command {}'.format(cmd))
+
+def serve(socket_path:str, workers:int=4, modules=PRELOAD):
+    import socketserver
+    preload(modules)
+    if os.path.exists(socket_path):
+        try:
+            request(socket_path,dict(cmd='status'))
+            print('ERROR: a daemon is already listening on',socket_path)
+            return 1
+        except OSError:
+            os.remove(socket_path)
+    daemon=Daemon(workers)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                res=daemon.handle(json.loads(self.rfile.readline()))
+            except Exception as e:
+                res=dict(error=str(e))
+            self.wfile.write((json.dumps(res)+'\n').encode())
+            self.wfile.flush()
+            if daemon.stopping: threading.Thread(target=self.server.shutdown).start()
+
+    old_umask=os.umask(0o177)
+    try:
+        server=socketserver.ThreadingUnixStreamServer(socket_path,Handler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads=True
+    print('pymipl daemon listening on {} with {} workers'.format(socket_path,workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        with daemon.lock: daemon.pool.shutdown(cancel_futures=True)
+    print('pymipl daemon stopped')
+    return 0
+
+def request(socket_path:str, req:dict):
+    '''
+    Send one request to the daemon and return the decoded answer.
+    '''
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(req)+'\n').encode())
+        with s.makefile('rb') as f:
+            line=f.readline()
+    if not line: raise OSError('no answer from the daemon on {}'.format(socket_path))
+    res=json.loads(line)
+    if 'error' in res: raise RuntimeError(res['error'])
+    return res
+
+def print_job(info):
+    timing='' if 'run_s' not in info else ' queued {:.2f} s, ran {:.2f} s, exit code {}'.format(info['queued_s'],info['run_s'],info['returncode'])
+    print('{:>5} {:8s} {} {}{}'.format(info['id'],info['state'],info['tool'],' '.join(info['args']),timing))
+
+class DefParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+if __name__=="__main__":
+    p=DefParser(description='Warm pymipl conversion daemon and its client')
+    p.add_argument('--socket',metavar='<path>',type=str,default=default_socket(),help='daemon socket [$PYMIPL_SOCKET or <tmp>/pymipl-<user>.sock]')
+    sub=p.add_subparsers(dest='command',required=True)
+    s=sub.add_parser('serve',help='start the daemon')
+    s.add_argument('--workers',metavar='<int>',type=int,default=4,help='maximum number of concurrent jobs [4]')
+    s=sub.add_parser('submit',help='run a tool command line on the daemon')
+    s.add_argument('--no_wait',action='store_true',default=False,help='print the job id and return without waiting [False]')
+    s.add_argument('tool',type=str,choices=TOOLS,help='tool name')
+    s.add_argument('args',nargs=argparse.REMAINDER,help='tool arguments')
+    s=sub.add_parser('status',help='list jobs, or show one job with its output')
+    s.add_argument('id',type=int,nargs='?',default=None,help='job id')
+    s=sub.add_parser('wait',help='wait for a job and print its output')
+    s.add_argument('id',type=int,help='job id')
+    sub.add_parser('shutdown',help='stop the daemon')
+    a=p.parse_args()
+
+    if a.command=='serve':
+        sys.exit(serve(a.socket,a.workers))
+    try:
+        if a.command=='submit':
+            id=request(a.socket,dict(cmd='submit',tool=a.tool,args=a.args,cwd=os.getcwd()))['id']
+            if a.no_wait:
+                print(id)
+                sys.exit(0)
+            a.command,a.id='wait',id
+        if a.command=='wait':
+            info=request(a.socket,dict(cmd='wait',id=a.id))
+            sys.stdout.write(info['output'])
+            print_job(info)
+            sys.exit(info['returncode'])
+        if a.command=='status':
+            if a.id is None:
+                for info in request(a.socket,dict(cmd='status'))['jobs']: print_job(info)
+            else:
+                info=request(a.socket,dict(cmd='status',id=a.id,output=True))
+                sys.stdout.write(info.get('output',''))
+                print_job(info)
+        if a.command=='shutdown':
+            request(a.socket,dict(cmd='shutdown'))
+    except (OSError,RuntimeError) as e:
+        print('ERROR:',e)
+        sys.exit(1)
@@ -0,0 +1,220 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os, sys, time, argparse, numpy as np, scipy.ndimage, nibabel as nib, nibabel.processing
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Multithreaded resampling with the semantics of nibabel.processing.resample_from_to
+(scipy.ndimage.affine_transform, mode='constant', cval=0): voxels mapped outside the
+input grid are zero, spline coefficients use mirror extension at the edges.
+Interpolation (order>0) runs in float32; nearest neighbour (order 0) keeps the input type.
+'''
+
+def get_nthreads(nthreads=None):
+    if nthreads is not None and nthreads>0: return nthreads
+    return int(os.environ.get('PYMIPL_THREADS',os.cpu_count() or 1))
+
+def get_slabs(n,nslabs):
+    '''
+    Split range(n) into at most nslabs contiguous [st,en) slabs.
+    '''
+    bounds=np.linspace(0,n,min(n,nslabs)+1).astype(int) if n>0 else [0,0]
+    return [(bounds[i],bounds[i+1]) for i in range(len(bounds)-1) if bounds[i+1]>bounds[i]]
+
+def run_slabs(func,n,nthreads):
+    '''
+    Call func(st,en) for slabs of range(n) on a thread pool.
+    '''
+    slabs=get_slabs(n,nthreads)
+    if len(slabs)<2:
+        for st,en in slabs: func(st,en)
+        return
+    with ThreadPoolExecutor(len(slabs)) as ex:
+        for f in [ex.submit(func,st,en) for st,en in slabs]: f.result()
+
+def is_separable(vox_map):
+    '''
+    True if the voxel map only scales and shifts along the array axes.
+    '''
+    rzs=np.asarray(vox_map)[:3,:3]
+    return np.count_nonzero(rzs-np.diag(np.diagonal(rzs)))==0
+
+def spline_coefficients(data,order,nthreads):
+    '''
+    B-spline prefilter, one axis at a time, each axis pass split into slabs along another axis.
+    '''
+    coef=np.array(data,dtype=np.float32)
+    if order<2: return coef
+    for axis in range(coef.ndim):
+        split=0 if axis!=0 else 1
+        def filt(st,en,axis=axis,split=split):
+            sl=[slice(None)]*coef.ndim; sl[split]=slice(st,en); sl=tuple(sl)
+            coef[sl]=scipy.ndimage.spline_filter1d(coef[sl],order,axis=axis,output=np.float32,mode='mirror')
+        run_slabs(filt,coef.shape[split],nthreads)
+    return coef
+
+def mirror_index(ind,n):
+    if n==1: return np.zeros_like(ind)
+    ind=np.abs(ind) % (2*n-2)
+    return np.where(ind>n-1,2*n-2-ind,ind)
+
+def axis_weights(scale,shift,nout,nin,order):
+    '''
+    Tap indices and weights [nout,ntaps] for 1D interpolation at x=scale*i+shift.
+    Output samples falling outside [0,nin-1] get zero weights.
+    '''
+    x=scale*np.arange(nout,dtype=np.float64)+shift
+    inside=(x>=0)&(x<=nin-1)
+    if order==0:
+        ind=np.floor(x+0.5).astype(np.int64)[:,None]
+        w=np.ones((nout,1),dtype=np.float32)
+    elif order==1:
+        x0=np.floor(x); t=(x-x0)[:,None]
+        ind=x0.astype(np.int64)[:,None]+np.arange(2)
+        w=np.hstack([1-t,t])
+    elif order==3:
+        x0=np.floor(x); t=(x-x0)[:,None]
+        ind=x0.astype(np.int64)[:,None]+np.arange(-1,3)
+        w=np.hstack([(1-t)**3,3*t**3-6*t**2+4,-3*t**3+3*t**2+3*t+1,t**3])/6.
+    else:
+        raise ValueError('separable resampling supports order 0, 1 or 3')
+    ind=mirror_index(ind,nin)
+    w=np.where(inside[:,None],w,0).astype(np.float32)
+    return ind,w
+
+def resample_separable(data,vox_map,out_shape,order,nthreads):
+    '''
+    Scale-and-shift resampling as three 1D passes, each split into slabs on a thread pool.
+    '''
+    M=np.asarray(vox_map,dtype=np.float64)
+    cur=data if order==0 else spline_coefficients(data,order,nthreads)
+    for axis in range(3):
+        ind,w=axis_weights(M[axis,axis],M[axis,3],out_shape[axis],cur.shape[axis],order)
+        shp=list(cur.shape); shp[axis]=out_shape[axis]
+        out=np.empty(shp,dtype=cur.dtype)
+        split=1 if axis==0 else 0
+        def interp(st,en,cur=cur,out=out,axis=axis,split=split,ind=ind,w=w):
+            sl=[slice(None)]*3; sl[split]=slice(st,en); sl=tuple(sl)
+            src=cur[sl]
+            if order==0:
+                acc=np.take(src,ind[:,0],axis=axis)
+                outside=[slice(None)]*3; outside[axis]=w[:,0]==0
+                acc[tuple(outside)]=0
+                out[sl]=acc
+                return
+            wshape=[1,1,1]; wshape[axis]=-1
+            acc=np.take(src,ind[:,0],axis=axis)*w[:,0].reshape(wshape)
+            for k in range(1,ind.shape[1]):
+                acc+=np.take(src,ind[:,k],axis=axis)*w[:,k].reshape(wshape)
+            out[sl]=acc
+        run_slabs(interp,shp[split],nthreads)
+        cur=out
+    return cur
+
+def resample_general(data,vox_map,out_shape,order,nthreads):
+    '''
+    General affine resampling, output split into slabs along the first axis.
+    '''
+    M=np.asarray(vox_map,dtype=np.float64)
+    rzs,trans=M[:3,:3],M[:3,3]
+    src=data if order==0 else spline_coefficients(data,order,nthreads)
+    out=np.empty(out_shape,dtype=src.dtype)
+    def interp(st,en):
+        out[st:en]=scipy.ndimage.affine_transform(src,rzs,offset=rzs[:,0]*st+trans,output_shape=(en-st,)+tuple(out_shape[1:]),
+                                                  order=order,mode='constant',cval=0,prefilter=False,output=src.dtype)
+    run_slabs(interp,out_shape[0],nthreads)
+    return out
+
+def resample_array(data,vox_map,out_shape,order=3,nthreads=None):
+    '''
+    Resample a 3D array. vox_map maps output voxel coordinates to input voxel coordinates.
+    '''
+    data=np.asanyarray(data)
+    if data.ndim!=3: raise ValueError('Only 3D arrays are supported.')
+    out_shape=tuple(int(s) for s in out_shape)
+    nthreads=get_nthreads(nthreads)
+    if is_separable(vox_map) and order in [0,1,3]:
+        return resample_separable(data,vox_map,out_shape,order,nthreads)
+    return resample_general(data,vox_map,out_shape,order,nthreads)
+
+def resample_from_to(from_img,to_vox_map,order=3,nthreads=None):
+    '''
+    Drop-in for nibabel.processing.resample_from_to (constant mode, zero fill).
+    to_vox_map: (shape, affine) of the output grid.
+    '''
+    out_shape,out_aff=to_vox_map
+    vox_map=np.linalg.inv(from_img.affine) @ out_aff
+    data=np.asanyarray(from_img.dataobj)
+    out=resample_array(data,vox_map,out_shape,order,nthreads)
+    return nib.Nifti1Image(out,out_aff,from_img.header)
+
+def conform_affine(affine,shape,out_shape,voxel_size,orientation='RAS'):
+    '''
+    Output affine nibabel.processing.conform would use for an image with the given affine and shape.
+    '''
+    ornt=nib.orientations
+    transform=ornt.ornt_transform(ornt.io_orientation(affine),ornt.axcodes2ornt(orientation))
+    reor_aff=affine @ ornt.inv_ornt_aff(transform,shape[:3])
+    reor_shape=np.array(shape[:3])[transform[:,0].astype(int)]
+    return nib.affines.rescale_affine(reor_aff,reor_shape,voxel_size,out_shape)
+
+def resample_to_output(img,voxel_sizes,order=3,nthreads=None):
+    '''
+    Multithreaded nibabel.processing.resample_to_output for 3D images.
+    '''
+    return resample_from_to(img,nib.processing.vox2out_vox((img.shape,img.affine),voxel_sizes),order,nthreads)
+
+def conform(img,out_shape,voxel_size=(1.0,1.0,1.0),order=3,nthreads=None):
+    '''
+    Multithreaded nibabel.processing.conform (RAS output) for 3D images.
+    '''
+    if img.ndim!=3: raise ValueError('Only 3D images are supported.')
+    out_aff=conform_affine(img.affine,img.shape,out_shape[:3],voxel_size)
+    return resample_from_to(img,(tuple(out_shape[:3]),out_aff),order,nthreads)
+
+def benchmark(shape,voxel_size,nthreads=None,repeats=1):
+    '''
+    Compare run time and output of this module against nibabel.processing.
+    '''
+    rng=np.random.default_rng(0)
+    aff=np.diag(list(voxel_size)+[1.])
+    aff[:3,3]=-np.array(shape)*np.array(voxel_size)/2
+    img=nib.Nifti1Image(scipy.ndimage.gaussian_filter(rng.random(shape,dtype=np.float32),2),aff)
+    msk=nib.Nifti1Image((img.get_fdata()>0.5).astype(np.uint8),aff)
+    rot=aff.copy(); rot[:3,:3]=nib.eulerangles.euler2mat(0.1,0.05,0) @ aff[:3,:3]
+    img_rot=nib.Nifti1Image(img.dataobj,rot)
+    tests=[('resample_to_output cubic',img,3,lambda im,o: nib.processing.resample_to_output(im,[1,1,1],order=o),
+            lambda im,o: resample_to_output(im,[1,1,1],o,nthreads)),
+           ('resample_to_output nearest',msk,0,lambda im,o: nib.processing.resample_to_output(im,[1,1,1],order=o),
+            lambda im,o: resample_to_output(im,[1,1,1],o,nthreads)),
+           ('conform cubic',img,3,lambda im,o: nib.processing.conform(im,shape,(1,1,1),order=o),
+            lambda im,o: conform(im,shape,(1,1,1),o,nthreads)),
+           ('resample_to_output cubic, rotated',img_rot,3,lambda im,o: nib.processing.resample_to_output(im,[1,1,1],order=o),
+            lambda im,o: resample_to_output(im,[1,1,1],o,nthreads))]
+    print('shape {}, voxel size {}, threads {}'.format(shape,voxel_size,get_nthreads(nthreads)))
+    for name,im,order,f_nib,f_new in tests:
+        t_nib,t_new=[],[]
+        for r in range(repeats):
+            t=time.time(); a=np.asanyarray(f_nib(im,order).dataobj); t_nib+=[time.time()-t]
+            t=time.time(); b=np.asanyarray(f_new(im,order).dataobj); t_new+=[time.time()-t]
+        diff=np.abs(a.astype(np.float64)-b).max() if a.shape==b.shape else np.nan
+        print('{:36s} nibabel {:7.3f}s ({}), pymipl {:7.3f}s ({}), speedup {:5.1f}x, max abs diff {:.2e}'.format(
+            name,min(t_nib),a.dtype,min(t_new),b.dtype,min(t_nib)/min(t_new),diff))
+
+if __name__=="__main__":
+    p=argparse.ArgumentParser(description='Benchmark multithreaded resampling against nibabel.processing')
+    p.add_argument('--shape',metavar='<int>',type=int,nargs=3,default=[256,256,160],help='test image shape [256 256 160]')
+    p.add_argument('--voxel_size',metavar='<float>',type=float,nargs=3,default=[0.9,0.9,1.2],help='test image voxel size [0.9 0.9 1.2]')
+    p.add_argument('--threads',metavar='<int>',type=int,default=None,help='number of threads [$PYMIPL_THREADS or all cores]')
+    p.add_argument('--repeats',metavar='<int>',type=int,default=1,help='number of timed repeats [1]')
+    a=p.parse_args()
+    benchmark(tuple(a.shape),a.voxel_size,a.threads,a.repeats)
@@ -0,0 +1,127 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os, os.path, hashlib, tempfile, numpy as np, nibabel as nib
+
+'''
+Content-addressed on-disk cache of resampled images.
+Location and size cap are taken from PYMIPL_CACHE_DIR [~/.cache/pymipl/resample]
+and PYMIPL_CACHE_MAX_MB [4096]. Setting PYMIPL_CACHE_DIR to an empty string disables caching.
+Entries are written atomically (temporary file + rename), so several processes can share one cache.
+'''
+
+def image_digest(img):
+    '''
+    Hash of image voxel payload and geometry.
+    '''
+    h=hashlib.blake2b(digest_size=20)
+    data=np.ascontiguousarray(np.asanyarray(img.dataobj))
+    h.update(str((data.shape,data.dtype.str)).encode())
+    h.update(np.asarray(img.affine,dtype=np.float64).tobytes())
+    slope,inter=img.header.get_slope_inter() if hasattr(img.header,'get_slope_inter') else (None,None)
+    h.update(str((slope,inter)).encode())
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+class ResampleCache:
+    def __init__(self,cache_dir=None,max_size_mb=None):
+        if cache_dir is None:
+            cache_dir=os.environ.get('PYMIPL_CACHE_DIR',os.path.join(os.path.expanduser('~'),'.cache','pymipl','resample'))
+        if max_size_mb is None:
+            max_size_mb=float(os.environ.get('PYMIPL_CACHE_MAX_MB',4096))
+        self.cache_dir=cache_dir
+        self.max_size=int(max_size_mb*1024*1024)
+        self.enabled=bool(cache_dir)
+
+    def key(self,img,params):
+        '''
+        Cache key from input image contents and resampling parameters.
+        '''
+        h=hashlib.blake2b(digest_size=20)
+        h.update(image_digest(img).encode())
+        h.update(repr(params).encode())
+        return h.hexdigest()
+
+    def _path(self,key):
+        return os.path.join(self.cache_dir,key+'.nii')
+
+    def get(self,key):
+        '''
+        Return cached image for key, or None. A hit refreshes the entry's LRU time stamp.
+        '''
+        if not self.enabled: return None
+        path=self._path(key)
+        try:
+            img=nib.load(path)
+            img=nib.Nifti1Image(np.asanyarray(img.dataobj),img.affine,img.header)
+            os.utime(path)
+        except (FileNotFoundError,OSError,nib.filebasedimages.ImageFileError):
+            return None
+        return img
+
+    def put(self,key,img):
+        '''
+        Store image atomically and evict least recently used entries over the size cap.
+        Voxels are stored in the dtype of the in-memory array, unscaled, so that a hit returns the same data as a miss.
+        '''
+        if not self.enabled: return
+        try:
+            os.makedirs(self.cache_dir,exist_ok=True)
+            fd,tmp=tempfile.mkstemp(prefix='tmp',suffix='.nii',dir=self.cache_dir)
+        except OSError as e:
+            print('WARNING: cannot write resample cache entry:',e)
+            return
+        #eviction skips tmp* files, so a failed write must remove its own
+        try:
+            os.close(fd)
+            data=np.asanyarray(img.dataobj)
+            hdr=img.header.copy()
+            hdr.set_data_dtype(data.dtype)
+            hdr.set_slope_inter(1,0)
+            nib.Nifti1Image(data,img.affine,hdr).to_filename(tmp)
+            os.replace(tmp,self._path(key))
+        except BaseException as e:
+            if os.path.exists(tmp): os.remove(tmp)
+            if not isinstance(e,OSError): raise
+            print('WARNING: cannot write resample cache entry:',e)
+            return
+        self.evict()
+
+    def evict(self):
+        entries=[]
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith('tmp') or not entry.name.endswith('.nii'): continue
+            try:
+                st=entry.stat()
+            except FileNotFoundError:
+                continue
+            entries+=[(st.st_mtime,st.st_size,entry.path)]
+        total=sum([e[1] for e in entries])
+        for mtime,size,path in sorted(entries):
+            if total<=self.max_size: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total-=size
+
+    def cached(self,func,img,params,*args):
+        '''
+        Return func(img,*args) from cache if available, computing and storing it otherwise.
+        params must describe everything besides img that determines the result.
+        '''
+        if not self.enabled: return func(img,*args)
+        key=self.key(img,params)
+        out=self.get(key)
+        if out is None:
+            out=func(img,*args)
+            self.put(key,out)
+        return out
@@ -0,0 +1,169 @@
+'''
+Copyright (c) 2026, Computational Imaging Lab, School of Medicine, Washington University in Saint Louis
+
+Redistribution and use in source and binary forms, for any purpose, with or without modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import re, argparse, os, numpy as np, meshio, pydicom
+from multiprocessing import Pool
+from PIL import Image,ImageDraw
+import mesh_numpy
+from utils import write_rec_file
+
+'''
+Convert RTSTRUCT ROIs to surface meshes without rasterizing the full image volume: each ROI's
+contour stack is rasterized only inside its own bounding box, on a supersampled in-plane grid,
+meshed, and the mesh points are mapped back to patient coordinates.
+'''
+
+def get_roi_contours(ds_rtss):
+    '''
+    Contour stacks of all ROIs in an RTSTRUCT dataset.
+    Returns a list of dicts with roi_number, roi_name and contours (list of [K,3] arrays in patient coordinates).
+    '''
+    if [0x3006,0x0020] not in ds_rtss:
+        raise ValueError('Cannot find (0x3006,0020) StructureSetROISequence tag in RTSS file')
+    roi_contours={ rc.ReferencedROINumber:rc for rc in ds_rtss.ROIContourSequence }
+    rois=[]
+    for ss in ds_rtss.StructureSetROISequence:
+        roi_name=re.sub(r'\W+', '', ss.ROIName)
+        rc=roi_contours.get(ss.ROINumber,None)
+        if rc is None or 'ContourSequence' not in rc:
+            print('WARNING: no contour sequence for ROI',roi_name)
+            continue
+        contours=[ np.array(c.ContourData,dtype=np.float64).reshape(-1,3) for c in rc.ContourSequence ]
+        rois+=[dict(roi_number=int(ss.ROINumber),roi_name=roi_name,contours=[c for c in contours if c.shape[0]>=3])]
+    return rois
+
+def get_slice_spacing(z):
+    '''
+    Spacing of the contour planes: smallest distance between distinct slice positions.
+    '''
+    z=np.unique(np.round(z,3))
+    return float(np.diff(z).min()) if z.shape[0]>1 else None
+
+def rasterize_contours(contours, pixel_size:float, supersampling:int=2):
+    '''
+    Rasterize a contour stack inside its bounding box, padded by one empty voxel on each side.
+    Contours on the same slice are combined by exclusive or, so inner contours cut holes.
+    Returns the mask [x,y,z], voxel spacing and the patient coordinates of voxel (0,0,0).
+    '''
+    pts=np.concatenate(contours)
+    ps=pixel_size/supersampling
+    z=np.array([c[0,2] for c in contours])
+    dz=get_slice_spacing(z) or pixel_size
+    origin=np.array([pts[:,0].min()-ps,pts[:,1].min()-ps,z.min()-dz])
+    shape=np.array([np.ceil((pts[:,0].max()-origin[0])/ps)+2,np.ceil((pts[:,1].max()-origin[1])/ps)+2,
+                    np.round((z.max()-origin[2])/dz)+2]).astype(int)
+    
+    mask=np.zeros(shape,dtype=np.uint8)
+    for c in contours:
+        k=int(np.round((c[0,2]-origin[2])/dz))
+        img=Image.new('L',(int(shape[0]),int(shape[1])),0)
+        #PIL puts the centre of pixel i at i+0.5
+        poly=((c[:,:2]-origin[:2])/ps+0.5).ravel().tolist()
+        ImageDraw.Draw(img).polygon(poly,outline=1,fill=1)
+        mask[:,:,k]^=np.transpose(np.array(img))
+    return mask,np.array([ps,ps,dz]),origin
+
+def mesh_roi(job):
+    '''
+    Mesh one ROI. Runs in a worker process.
+    job: (roi dict from get_roi_contours, pixel size, supersampling, smoothing)
+    Returns (roi name, points in patient coordinates, triangles).
+    '''
+    roi,pixel_size,supersampling,smoothing=job
+    if len(roi['contours'])==0: return roi['roi_name'],None,None
+    mask,spacing,origin=rasterize_contours(roi['contours'],pixel_size,supersampling)
+    points,triangles=mesh_numpy.extract_mesh(mask,spacing,0.5)
+    if smoothing: points=mesh_numpy.smoothen_mesh(points,triangles)
+    return roi['roi_name'],points+origin,triangles
+
+def check_centroid(center=(5.,-3.), radius:float=20., slice_spacing:float=2., pixel_size:float=1.0, supersampling:int=2):
+    '''
+    Mesh a stack of circular contours of a sphere and compare the area-weighted mesh centroid
+    with the sphere centre. Returns the centroid offset in mm.
+    '''
+    t=np.linspace(0,2*np.pi,200,endpoint=False)
+    contours=[]
+    for z in np.arange(-radius+slice_spacing,radius,slice_spacing):
+        r=np.sqrt(radius**2-z**2)
+        contours+=[np.stack([center[0]+r*np.cos(t),center[1]+r*np.sin(t),np.full(t.shape,z)],1)]
+    _,points,triangles=mesh_roi((dict(roi_name='sphere',contours=contours),pixel_size,supersampling,False))
+    a,b,c=points[triangles[:,0]],points[triangles[:,1]],points[triangles[:,2]]
+    area=np.linalg.norm(np.cross(b-a,c-a),axis=1)
+    centroid=((a+b+c)/3*area[:,None]).sum(0)/area.sum()
+    offset=centroid-np.array([center[0],center[1],0.])
+    print('supersampling {}: mesh centroid {}, offset {} mm'.format(supersampling,np.round(centroid,4),np.round(offset,4)))
+    return offset
+
+def get_roi_mesh_file(out_mesh_file:str,roi_name:str):
+    root,ext=os.path.splitext(out_mesh_file)
+    return '{}_{}{}'.format(root,roi_name,ext)
+
+def rtss2mesh(in_rtss:str, out_mesh_file:str, rois:list=None, exclude_labels:list=[], pixel_size:float=1.0,
+              supersampling:int=2, smoothing:bool=True, lps:bool=False, nworkers:int=4):
+    '''
+    Write one mesh per ROI of an RTSTRUCT to <out_mesh_root>_<roi name>.<ext>.
+    Mesh points are NIFTI world (RAS) coordinates, or DICOM patient coordinates with lps=True.
+    Returns the list of written files.
+    '''
+    ds_rtss=pydicom.dcmread(in_rtss)
+    roi_list=get_roi_contours(ds_rtss)
+    if rois is not None: roi_list=[r for r in roi_list if r['roi_name'].lower() in rois]
+    roi_list=[r for r in roi_list if r['roi_name'].lower() not in exclude_labels]
+    print('meshing {} ROIs'.format(len(roi_list)))
+    
+    jobs=[(r,pixel_size,supersampling,smoothing) for r in roi_list]
+    out_files=[]
+    with Pool(nworkers) as pool:
+        for roi_name,points,triangles in pool.imap(mesh_roi,jobs):
+            if points is None or triangles.shape[0]==0:
+                print('WARNING: empty mesh for ROI',roi_name)
+                continue
+            if not lps: points=points*np.array([-1.,-1.,1.])
+            out_file=get_roi_mesh_file(out_mesh_file,roi_name)
+            print('writing {}, {} triangles'.format(out_file,triangles.shape[0]))
+            mesh=meshio.Mesh(points,[('triangle',triangles)])
+            if out_file.lower().endswith('.stl'): meshio.write(out_file,mesh,binary=True)
+            else: meshio.write(out_file,mesh)
+            out_files+=[out_file]
+    return out_files
+
+def get_parser():
+    """
+    Parse input arguments.
+    """
+    parser = argparse.ArgumentParser(description='Convert DICOM RT structures to surface meshes, one mesh per ROI')
+
+    # Positional arguments.
+    parser.add_argument("in_rtss", help="Input DICOM RTSTRUCT file")
+    parser.add_argument("out_mesh_file", help="Output mesh file; ROI name is appended to the file root")
+    parser.add_argument("--rois", metavar="<string>",type=str,default=None,
+                        help="Comma separated list of ROI labels to mesh, case insensitive [all]")
+    parser.add_argument("--exclude_labels", metavar="<string>",type=str,default=None,
+                        help="Comma separated list of ROI labels to exclude, case insensitive [None]")
+    parser.add_argument("--pixel_size", metavar="<float>",type=float,default=1.0,
+                        help="in-plane raster pixel size (mm) before supersampling [1.0]")
+    parser.add_argument("--supersampling", metavar="<int>",type=int,default=2,
+                        help="in-plane supersampling factor [2]")
+    parser.add_argument("--no_mesh_smoothing", action="store_true", default=False, help="do not smooth meshes [False]")
+    parser.add_argument("--lps", action="store_true", default=False,
+                        help="write DICOM patient (LPS) coordinates instead of NIFTI world (RAS) [False]")
+    parser.add_argument("--workers", metavar="<int>",type=int,default=4, help="number of worker processes [4]")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    p = get_parser()
+    rois=None if p.rois is None else [r.lower() for r in p.rois.split(',')]
+    exc_labels=[] if p.exclude_labels is None else [r.lower() for r in p.exclude_labels.split(',')]
+    out_files=rtss2mesh(p.in_rtss,p.out_mesh_file,rois,exc_labels,p.pixel_size,p.supersampling,
+                        not p.no_mesh_smoothing,p.lps,p.workers)
+    for f in out_files:
+        write_rec_file(f,infiles=[p.in_rtss])
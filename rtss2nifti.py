@@ -10,7 +10,7 @@ Redistribution and use in source and binary forms, for any purpose, with or with
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import re,random, nibabel as nib, argparse, numpy as np, os, json
+import sys, re,random, nibabel as nib, argparse, numpy as np, os, json
 from datetime import datetime
 from skimage import measure
 from PIL import Image,ImageDraw
@@ -21,25 +21,8 @@ from pydicom.sequence import Sequence
 from nibabel.nifti1 import Nifti1Image,Nifti1Header
 import nibabel.nifti1
 
-from utils import write_rec_file
-
-def sort_dcms_by_slice_pos(input_dicom_path,dcm_files,stop_before_pixels=True):
-    '''
-    Sort DICOMs from an input directory (assumed to contain a single study) according to slice position
-    Output: a sorted list of DICOM datasets
-    '''
-    dcmss=[]
-    for idx,dcm in enumerate(dcm_files):
-        ds = pydicom.dcmread(os.path.join(input_dicom_path,dcm), stop_before_pixels)
-        if idx==0:           
-            if 'ImagePositionPatient' in ds: sortTag='ImagePositionPatient'
-            elif 'SliceLocation' in ds: sortTag='SliceLocation'
-            else: return None
-        if not sortTag in ds: return None
-        if sortTag=='ImagePositionPatient': z=ds.ImagePositionPatient[2]
-        else: z=ds.SliceLocation
-        dcmss+=[dict(file=dcm,dataset=ds,z=z)]
-    return sorted(dcmss, key=lambda dcms: dcms['z'])
+from dicom_series import load_series, sort_dcms_by_slice_pos, voxel_array_from_sorted_dicoms
+from utils import write_rec_file, job_signature, job_params, up_to_date, add_incremental_args
 
 def get_rasterized_poly_slice(poly2d, imwid, imht):
     '''
@@ -77,44 +60,37 @@ def pts2poly(pts, origin, mm2vox_size):
     
     return list(poly),z
 
-def voxel_array_from_sorted_dicoms(dicomsSorted):
+def get_roi_mask_file(output_rtss_nii:str, roi_name:str):
     '''
-    extract the 3D voxel array from a list of sorted DICOM objects.
+    Mask file of one ROI with --separate_masks: ROI name appended to the file root, extension kept.
     '''
-    ind=0
-    
-    if len(dicomsSorted) < 1: return None
-    ds0=dicomsSorted[0]['dataset']
-    
-    imwidth,imheight,imdepth=ds0.Rows,ds0.Columns,len(dicomsSorted)
-    pixeldata_type=ds0.pixel_array.dtype
-    voxels=np.zeros([imwidth,imheight,imdepth],dtype=pixeldata_type)
-    
-    for i in range(len(dicomsSorted)):
-        voxels[:,:,i]=np.transpose(dicomsSorted[i]['dataset'].pixel_array)
-        
-    return voxels
+    root,ext=output_rtss_nii,''
+    for e in ['.nii.gz','.nii']:
+        if output_rtss_nii.endswith(e): root,ext=output_rtss_nii[:-len(e)],e; break
+    return '{}_{}{}'.format(root,roi_name,ext)
 
 def rtss_to_nifti(input_rtstruct_dicom:str, input_structural_dicom:str,output_rtss_nii:str,
                   output_struct_nii:str, exclude_labels:list, write_one_roi_per_file:bool):
     
     '''
     Convert RTSTRUCT and structural DICOM to a NIFTI mask.    
+    Returns the list of written mask files.
     '''
     
     #1. read the structural image.
-    dicomFiles = next(os.walk(input_structural_dicom))[2]
-    numberOfDicomImages = len(dicomFiles)
-    dicomsSorted=sort_dcms_by_slice_pos(input_structural_dicom,dicomFiles,stop_before_pixels=False)
+    series=load_series(input_structural_dicom)
+    numberOfDicomImages = len(series)
+    dicomsSorted=series.dicoms
     ds_struct=dicomsSorted[0]['dataset']
-    struct_voxels=voxel_array_from_sorted_dicoms(dicomsSorted)
+    struct_voxels=series.get_voxels()
 
     xPixelSize,yPixelSize=ds_struct.PixelSpacing[0],ds_struct.PixelSpacing[1]
     xyPixelSize=0.5*(xPixelSize+yPixelSize)
     #for now; remember to update with DistanceBetweenSlices
     zPixelSize=ds_struct.SliceThickness
 
-    imwidth,imheight,imdepth=ds_struct.Rows,ds_struct.Columns,len(dicomsSorted)
+    #masks follow the [column,row,slice] layout of the series voxels
+    imwidth,imheight,imdepth=series.shape
     voxel_vol_mm3=xPixelSize*yPixelSize*zPixelSize
     
 
@@ -222,7 +198,7 @@ def rtss_to_nifti(input_rtstruct_dicom:str, input_structural_dicom:str,output_rt
         if not write_one_roi_per_file:
             out_file=output_rtss_nii
         else: 
-            out_file=output_rtss_nii+'_'+roi_name
+            out_file=get_roi_mask_file(output_rtss_nii,roi_name)
             
         roi_descriptor=dict(roi_number=roi_number,
                             roi_name=roi_name,
@@ -270,6 +246,7 @@ def rtss_to_nifti(input_rtstruct_dicom:str, input_structural_dicom:str,output_rt
     print('writing',output_struct_nii)
     nibabel.nifti1.save(nifti_image_struct,output_struct_nii)
     print('done')    
+    return [output_rtss_nii] if not write_one_roi_per_file else [r['out_file_root'] for r in roi_list]
     
 def get_parser():
     """
@@ -286,6 +263,7 @@ def get_parser():
     parser.add_argument("--exclude_labels", metavar="<string>",type=str,default=None,
                         help="Comma separated list of ROI labels to exclude, case insensitive [None]")
     parser.add_argument("--separate_masks", action="store_true", default=False, help="write each ROI mask in a separate file [False]")
+    add_incremental_args(parser)
 
     return parser.parse_args()
     
@@ -298,11 +276,23 @@ if __name__ == "__main__":
     for i in range(len(exc_labels)):
         exc_labels[i]=exc_labels[i].lower()
         
-    rtss_to_nifti(p.in_rtss, p.in_struct_dir,p.out_roi_mask,
-                  structural,exc_labels,p.separate_masks)
+    infiles=[p.in_rtss,p.in_struct_dir]
+    sig=job_signature(infiles,job_params('rtss2nifti',p),p.hash)
+    #every output has a .rec with the signature; separate mask files are listed in the JSON sidecar
+    json_file=p.out_roi_mask+'.json'
+    if p.incremental and up_to_date(json_file,sig,infiles) and up_to_date(structural,sig,infiles,'nii'):
+        with open(json_file,'r') as f: mask_files=sorted(set([r['out_file_root'] for r in json.load(f)]))
+        if not p.separate_masks: mask_files=[p.out_roi_mask]
+        if all([up_to_date(m,sig,infiles) for m in mask_files]):
+            print(p.out_roi_mask,'and',structural,'are up to date')
+            sys.exit(0)
+
+    mask_files=rtss_to_nifti(p.in_rtss, p.in_struct_dir,p.out_roi_mask,
+                             structural,exc_labels,p.separate_masks)
     
-    write_rec_file(p.out_roi_mask,main_extension='nii',infiles=[p.in_rtss,p.in_struct_dir])
-    write_rec_file(structural,main_extension='nii',infiles=[p.in_rtss,p.in_struct_dir])
+    for f in mask_files+[json_file]:
+        write_rec_file(f,infiles=infiles,signature=sig)
+    write_rec_file(structural,main_extension='nii',infiles=infiles,signature=sig)
     
     print('done')
            
\ No newline at end of file
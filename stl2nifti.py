@@ -10,56 +10,292 @@ Redistribution and use in source and binary forms, for any purpose, with or with
 THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
-import argparse,stltovoxel,numpy as np
-from nibabel.nifti1 import Nifti1Image,Nifti1Header
+import sys, argparse, os, json, numpy as np, nibabel as nib
+from multiprocessing import Pool
+from nibabel.nifti1 import Nifti1Image
 import nibabel.nifti1
-from utils import write_rec_file
+from utils import write_rec_file, job_signature, job_params, up_to_date, add_incremental_args
 from stl import mesh
 
-def stl2nifti(infile:str,outfile:str, resolution:int, padding_fraction:float):
-    #read stl mesh from file
-    print("Creating mesh")
-    mesh_obj=mesh.Mesh.from_file(infile)    
+#small irrational offsets of the ray positions, so that rays do not pass exactly through mesh vertices or edges.
+RAY_OFFSET=np.array([0.7548776662466927e-5,0.5698402909980532e-5])
+
+def read_stl_triangles(infile:str, lps:bool=False):
+    '''
+    Read triangles from an STL file as an [N,3,3] array (triangle, vertex, xyz).
+    lps: STL coordinates are DICOM patient (LPS) coordinates; convert to NIFTI (RAS) world.
+    '''
+    mesh_obj=mesh.Mesh.from_file(infile)
+    tri=np.stack([mesh_obj.v0,mesh_obj.v1,mesh_obj.v2],axis=1).astype(np.float64)
+    if lps: tri[:,:,:2]*=-1
+    return tri
+
+def grid_from_reference(ref_file:str):
+    '''
+    Target grid (shape, affine) of a reference NIFTI image.
+    '''
+    ref=nib.load(ref_file)
+    return tuple(ref.shape[:3]),ref.affine
+
+def grid_from_voxel_size(triangles, voxel_size, padding_fraction:float=0.0):
+    '''
+    Axis aligned grid with given voxel size covering the mesh, padded on each side by a fraction of its size.
+    '''
+    vs=np.array(voxel_size,dtype=np.float64)*np.ones(3)
+    lo,hi=triangles.reshape(-1,3).min(axis=0),triangles.reshape(-1,3).max(axis=0)
+    n=np.ceil((hi-lo)/vs).astype(int)+1
+    pad=(n*padding_fraction).astype(int)
+    affine=np.diag(np.append(vs,1.0))
+    affine[:3,3]=lo-pad*vs
+    return tuple(int(s) for s in n+2*pad),affine
+
+def ray_crossings(tri_vox, i_range):
+    '''
+    Intersections of rays along the third voxel axis, through voxel centers (i,j) with
+    i_range[0]<=i<i_range[1], with triangles in voxel coordinates.
+    Returns arrays i, j, k (float) of all crossings.
+    '''
+    a,b,c=tri_vox[:,0],tri_vox[:,1],tri_vox[:,2]
+    lo,hi=tri_vox[:,:,:2].min(axis=1),tri_vox[:,:,:2].max(axis=1)
+    i0=np.maximum(np.ceil(lo[:,0]-RAY_OFFSET[0]).astype(np.int64),i_range[0])
+    i1=np.minimum(np.floor(hi[:,0]-RAY_OFFSET[0]).astype(np.int64),i_range[1]-1)
+    j0=np.ceil(lo[:,1]-RAY_OFFSET[1]).astype(np.int64)
+    j1=np.floor(hi[:,1]-RAY_OFFSET[1]).astype(np.int64)
+    ni,nj=np.maximum(i1-i0+1,0),np.maximum(j1-j0+1,0)
+    counts=ni*nj
+    
+    #enumerate all (triangle, ray) candidate pairs
+    t=np.repeat(np.arange(tri_vox.shape[0]),counts)
+    local=np.arange(t.shape[0])-np.repeat(np.cumsum(counts)-counts,counts)
+    ii=i0[t]+local//nj[t]
+    jj=j0[t]+local%nj[t]
+    px,py=ii+RAY_OFFSET[0],jj+RAY_OFFSET[1]
     
-    #make 'organized mesh', format to input to stltovoxel.
-    org_mesh = np.hstack((mesh_obj.v0[:, np.newaxis], mesh_obj.v1[:, np.newaxis], mesh_obj.v2[:, np.newaxis]))
-    meshdim=(np.amax(org_mesh,0)-np.amin(org_mesh,0))[0]  
+    #barycentric coordinates of ray positions in the projected triangles
+    ax,ay,bx,by,cx,cy=a[t,0],a[t,1],b[t,0],b[t,1],c[t,0],c[t,1]
+    d=(bx-ax)*(cy-ay)-(cx-ax)*(by-ay)
+    w0=(bx-px)*(cy-py)-(cx-px)*(by-py)
+    w1=(cx-px)*(ay-py)-(ax-px)*(cy-py)
+    w2=d-w0-w1
+    s=np.sign(d)
+    inside=(d!=0)&(w0*s>0)&(w1*s>0)&(w2*s>0)
+    t,ii,jj,w0,w1,w2,d=t[inside],ii[inside],jj[inside],w0[inside],w1[inside],w2[inside],d[inside]
+    kk=(w0*a[t,2]+w1*b[t,2]+w2*c[t,2])/d
+    return ii,jj,kk
 
-    print('meshdim',meshdim)
-    #convert mesh to raster
-    print("Converting mesh to raster")
-    vol,_,_=stltovoxel.convert_mesh(org_mesh,resolution=resolution)
+def fill_slab(args):
+    '''
+    Parity fill of voxels with i in [i_st,i_en). Runs in a worker process.
+    args: (triangles in voxel coordinates, i_st, i_en, j_st, j_en, number of voxels along k)
+    Returns a uint8 mask of shape [i_en-i_st, j_en-j_st, nk].
+    '''
+    tri_vox,i_st,i_en,j_st,j_en,nk=args
+    out=np.zeros((i_en-i_st,j_en-j_st,nk),dtype=np.uint8)
+    if tri_vox.shape[0]==0: return out
+    ii,jj,kk=ray_crossings(tri_vox,(i_st,i_en))
+    keep=(jj>=j_st)&(jj<j_en)
+    ii,jj,kk=ii[keep]-i_st,jj[keep]-j_st,kk[keep]
+    if ii.shape[0]==0: return out
+    
+    #sort crossings along each ray; pair them as (entry, exit)
+    order=np.lexsort((kk,jj,ii))
+    ii,jj,kk=ii[order],jj[order],kk[order]
+    col=ii*(j_en-j_st)+jj
+    first=np.r_[True,col[1:]!=col[:-1]]
+    start=np.maximum.accumulate(np.where(first,np.arange(col.shape[0]),0))
+    rank=np.arange(col.shape[0])-start
+    ncol=np.bincount(col)[col]
+    entry=(rank%2==0)&(rank+1<ncol)
+    e=np.nonzero(entry)[0]
+    
+    #voxel centers k with k_entry < k <= k_exit are inside
+    kst=np.clip(np.floor(kk[e]).astype(np.int64)+1,0,nk)
+    ken=np.clip(np.floor(kk[e+1]).astype(np.int64)+1,0,nk)
+    valid=ken>kst
+    diff=np.zeros((i_en-i_st,j_en-j_st,nk+1),dtype=np.int32)
+    np.add.at(diff,(ii[e][valid],jj[e][valid],kst[valid]),1)
+    np.add.at(diff,(ii[e][valid],jj[e][valid],ken[valid]),-1)
+    out[:]=np.cumsum(diff[:,:,:nk],axis=2)>0
+    return out
 
-    #create output nifti file
-    nifti_affine=np.diag(np.array([meshdim[2]/vol.shape[0],meshdim[1]/vol.shape[1],meshdim[0]/vol.shape[2],1]))
+def get_slab_jobs(triangles, shape, affine, slab_size:int=16):
+    '''
+    Map a mesh to voxel coordinates of the grid (shape, affine) and split its bounding box
+    into slabs along the first axis. Returns a list of fill_slab jobs, empty if the mesh is off the grid.
+    '''
+    tri_vox=nib.affines.apply_affine(np.linalg.inv(affine),triangles.reshape(-1,3)).reshape(-1,3,3)
+    if tri_vox.shape[0]==0: return []
+    lo,hi=tri_vox.reshape(-1,3).min(axis=0),tri_vox.reshape(-1,3).max(axis=0)
+    st=np.clip(np.ceil(lo).astype(int),0,shape)
+    en=np.clip(np.floor(hi).astype(int)+1,0,shape)
+    if np.any(en<=st): return []
     
-    #pad raster with zeroes, pad size calculated as fraction of each linear dimension
-    sh=np.array(vol.shape);
-    pad=(sh*padding_fraction).astype(int)        
-    vol1=np.pad(vol, [(pad[0],pad[0]),(pad[1],pad[1]),(pad[2],pad[2])] )
+    tri_lo,tri_hi=tri_vox[:,:,0].min(axis=1),tri_vox[:,:,0].max(axis=1)
+    jobs=[]
+    for i_st in range(st[0],en[0],slab_size):
+        i_en=min(i_st+slab_size,en[0])
+        sel=(tri_hi>=i_st-1)&(tri_lo<=i_en)
+        jobs+=[(tri_vox[sel],i_st,i_en,int(st[1]),int(en[1]),shape[2])]
+    return jobs
+
+def label_dtype(labels):
+    '''
+    Smallest unsigned type that holds all label values.
+    '''
+    m=max(labels,default=0)
+    return np.uint8 if m<1<<8 else np.uint16 if m<1<<16 else np.uint32
+
+def voxelize_meshes(meshes, labels, shape, affine, nworkers:int=4, slab_size:int=16):
+    '''
+    Rasterize closed triangle meshes (world coordinates) into one label map on the grid (shape, affine).
+    Meshes are given in increasing priority: where parts overlap, the later one wins.
+    Slabs of all meshes are filled on one pool of workers.
+    Returns the label map and the number of voxels of each label.
+    '''
+    shape=tuple(int(s) for s in shape[:3])
+    out=np.zeros(shape,dtype=label_dtype(labels))
+    jobs,job_labels=[],[]
+    for triangles,label in zip(meshes,labels):
+        mesh_jobs=get_slab_jobs(triangles,shape,affine,slab_size)
+        if len(mesh_jobs)==0: print('WARNING: mesh with label {} is outside the target grid'.format(label))
+        jobs+=mesh_jobs; job_labels+=[label]*len(mesh_jobs)
     
-    #write out
+    #results arrive in job order, so painting them in turn applies the priority.
+    if nworkers>1 and len(jobs)>1:
+        with Pool(nworkers) as pool:
+            for job,label,slab in zip(jobs,job_labels,pool.imap(fill_slab,jobs)):
+                out[job[1]:job[2],job[3]:job[4],:][slab>0]=label
+    else:
+        for job,label in zip(jobs,job_labels):
+            out[job[1]:job[2],job[3]:job[4],:][fill_slab(job)>0]=label
+    if out.dtype.itemsize<4:
+        counts=np.bincount(out.ravel(),minlength=max(labels,default=0)+1)
+        return out,{ l:int(counts[l]) for l in labels }
+    counts=dict(zip(*np.unique(out,return_counts=True)))
+    return out,{ l:int(counts.get(l,0)) for l in labels }
+
+def voxelize_mesh(triangles, shape, affine, nworkers:int=4, slab_size:int=16):
+    '''
+    Rasterize a closed triangle mesh (world coordinates) onto the grid (shape, affine).
+    Returns a uint8 mask.
+    '''
+    return voxelize_meshes([triangles],[1],shape,affine,nworkers,slab_size)[0]
+
+def get_grid(triangles, resolution:int=512, padding_fraction:float=0.25, reference:str=None, voxel_size:float=None):
+    '''
+    Target grid: the grid of a reference NIFTI image, or an axis aligned grid with the given voxel size,
+    or resolution voxels along the largest mesh dimension.
+    '''
+    if reference is not None:
+        return grid_from_reference(reference)
+    if voxel_size is None:
+        extent=triangles.reshape(-1,3).max(axis=0)-triangles.reshape(-1,3).min(axis=0)
+        voxel_size=extent.max()/resolution
+    return grid_from_voxel_size(triangles,voxel_size,padding_fraction)
+
+def save_mask(vol, affine, outfile:str):
     print("Writing",outfile)
-    nifti_image=Nifti1Image(vol1,nifti_affine)
+    nifti_image=Nifti1Image(vol,affine)
+    nifti_image.set_qform(affine,code=1)
+    nifti_image.set_sform(affine,code=1)
     nibabel.nifti1.save(nifti_image,outfile)
 
+def stl2nifti(infile:str,outfile:str, resolution:int=512, padding_fraction:float=0.25, reference:str=None,
+              voxel_size:float=None, lps:bool=False, nworkers:int=4):
+    '''
+    Convert a closed STL mesh to a binary NIFTI mask.
+    '''
+    print("Reading mesh",infile)
+    triangles=read_stl_triangles(infile,lps)
+    shape,affine=get_grid(triangles,resolution,padding_fraction,reference,voxel_size)
+    print('grid',shape,'voxel size',nib.affines.voxel_sizes(affine))
+    
+    print("Converting mesh to raster")
+    vol=voxelize_mesh(triangles,shape,affine,nworkers)
+    save_mask(vol,affine,outfile)
+
+def stls2nifti(infiles:list, outfile:str, labels:list=None, priority:list=None, resolution:int=512,
+               padding_fraction:float=0.25, reference:str=None, voxel_size:float=None, lps:bool=False, nworkers:int=4):
+    '''
+    Convert several closed STL meshes to one NIFTI label map on a shared grid, and write
+    a JSON label table to <outfile>.json.
+    labels: label value of each mesh [1..N]
+    priority: label values from highest to lowest overlap priority [order of infiles]
+    '''
+    labels=list(range(1,len(infiles)+1)) if labels is None else labels
+    if len(labels)!=len(infiles): raise ValueError('number of labels does not match number of STL files')
+    if len(set(labels))!=len(labels): raise ValueError('labels must be unique')
+    if min(labels)<1 or max(labels)>np.iinfo(np.uint32).max:
+        raise ValueError('labels must be in the range 1..{}'.format(np.iinfo(np.uint32).max))
+    if priority is None: priority=labels
+    if sorted(priority)!=sorted(labels): raise ValueError('priority must list every label once')
+    
+    meshes=[]
+    for f in infiles:
+        print("Reading mesh",f)
+        meshes+=[read_stl_triangles(f,lps)]
+    shape,affine=get_grid(np.concatenate(meshes),resolution,padding_fraction,reference,voxel_size)
+    print('grid',shape,'voxel size',nib.affines.voxel_sizes(affine))
+    
+    #paint from lowest to highest priority.
+    order=[labels.index(l) for l in priority[::-1]]
+    print("Converting {} meshes to raster".format(len(meshes)))
+    vol,counts=voxelize_meshes([meshes[i] for i in order],[labels[i] for i in order],shape,affine,nworkers)
+    save_mask(vol,affine,outfile)
+    
+    voxel_vol_mm3=float(np.prod(nib.affines.voxel_sizes(affine)))
+    label_table=[ dict(label_name=os.path.basename(f).rsplit('.',1)[0],
+                       intensity_value=l,
+                       in_file=f,
+                       num_triangles=int(m.shape[0]),
+                       priority=priority.index(l)+1,
+                       volume_mm3=counts[l]*voxel_vol_mm3) for f,l,m in zip(infiles,labels,meshes) ]
+    print('writing',outfile+'.json')
+    with open(outfile+'.json','w') as fout:
+        json.dump(label_table,fout,indent=2)
+
 def get_parser():
     """
     Parse input arguments.
     """
-    parser = argparse.ArgumentParser(description='Convert stereolithography file to NIFTI binary mask')
+    parser = argparse.ArgumentParser(description='Convert stereolithography file(s) to NIFTI binary mask or label map')
 
     # Positional arguments.
-    parser.add_argument("in_stl", help="Input stl file")
+    parser.add_argument("in_stl", nargs='+', help="Input stl file(s)")
     parser.add_argument("out_nii", help="Output NIFTI file")
     parser.add_argument("--resolution", metavar="<int>",type=int,default=512,
                         help="size in voxels of the biggest dimension of the output raster [512]")
     parser.add_argument("--padding_fraction", metavar="<float>",type=float,default=0.25,
                         help="fraction of the output raster size for bilateral zero padding [0.25]")
+    parser.add_argument("--reference", metavar="<nifti file>",type=str,default=None,
+                        help="rasterize onto the grid of this NIFTI image [None]")
+    parser.add_argument("--voxel_size", metavar="<float>",type=float,default=None,
+                        help="isotropic voxel size (mm) of the output raster, overrides --resolution [None]")
+    parser.add_argument("--labels", metavar="<string>",type=str,default=None,
+                        help="comma separated label values, one per input stl file [1,2,...]")
+    parser.add_argument("--priority", metavar="<string>",type=str,default=None,
+                        help="comma separated label values from highest to lowest overlap priority [order of input files]")
+    parser.add_argument("--lps", action="store_true", default=False,
+                        help="STL coordinates are DICOM patient (LPS) coordinates [False]")
+    parser.add_argument("--workers", metavar="<int>",type=int,default=4, help="number of worker processes [4]")
+    add_incremental_args(parser)
     
     return parser.parse_args()
 
 if __name__ == "__main__":
     p = get_parser()
-    stl2nifti(p.in_stl,p.out_nii,p.resolution,p.padding_fraction)
-    write_rec_file(p.out_nii,main_extension='nii',infiles=[p.in_stl])
\ No newline at end of file
+    infiles=p.in_stl if p.reference is None else p.in_stl+[p.reference]
+    sig=job_signature(infiles,job_params('stl2nifti',p),p.hash)
+    #the label map also writes a JSON label table, which gets its own .rec
+    label_map=len(p.in_stl)>1 or p.labels is not None
+    if p.incremental and up_to_date(p.out_nii,sig,infiles,'nii') and (not label_map or up_to_date(p.out_nii+'.json',sig,infiles)):
+        print(p.out_nii,'is up to date')
+        sys.exit(0)
+    if not label_map:
+        stl2nifti(p.in_stl[0],p.out_nii,p.resolution,p.padding_fraction,p.reference,p.voxel_size,p.lps,p.workers)
+    else:
+        labels=None if p.labels is None else [int(l) for l in p.labels.split(',')]
+        priority=None if p.priority is None else [int(l) for l in p.priority.split(',')]
+        stls2nifti(p.in_stl,p.out_nii,labels,priority,p.resolution,p.padding_fraction,p.reference,p.voxel_size,p.lps,p.workers)
+        write_rec_file(p.out_nii+'.json',infiles=infiles,signature=sig)
+    write_rec_file(p.out_nii,main_extension='nii',infiles=infiles,signature=sig)
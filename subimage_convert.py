@@ -15,6 +15,10 @@ import numpy as np,skimage,nibabel as nib, nibabel.processing, nibabel.funcs
 from skimage import measure, filters, morphology
 from skimage.transform import rescale, resize
 from utils import write_rec_file
+from resample_cache import ResampleCache
+import resample
+
+resample_cache=ResampleCache()
 
 def get_cube_type(max_size):
     tum_size_map=[
@@ -30,20 +34,21 @@ def get_cube_type(max_size):
     print('ROI size {}mm exceeded maximum ROI size ({}mm)!'.format(max_size,tum_size_map[-1]['range'][1]))
     return None
     
+def _resample_image_111(img_in,order):
+    return resample.resample_to_output(img_in,[1,1,1],order=order)
+
+def _conform_image_111(img_in,ref_shape,order):
+    #Output orientation for now is RAS.
+    return resample.conform(img_in,ref_shape,voxel_size=(1.0,1.0,1.0),order=order)
+
 def resample_image_111(img_in,is_mask):
     order=0 if is_mask else 3
-    return nib.processing.resample_to_output(img_in,[1,1,1],order=order)
+    return resample_cache.cached(_resample_image_111,img_in,('resample_to_output',(1,1,1),order,'float32'),order)
 
 def conform_image_111(img_in,img_ref,is_mask):
     order=0 if is_mask else 3
-    #print(img_in.affine)
-    
-    #Output orientation for now is RAS.
-    out=nibabel.processing.conform(img_in,img_ref.shape,voxel_size=(1.0,1.0,1.0),order=order)
-    #out.affine=np.diag(np.sign(np.diagonal(img_in.affine)))
-    #out.set_qform(np.diag(np.sign(np.diagonal(img_in.affine))))
-    #print(out.affine)
-    return out
+    ref_shape=tuple(img_ref.shape)
+    return resample_cache.cached(_conform_image_111,img_in,('conform',ref_shape,(1,1,1),order,'float32'),ref_shape,order)
 
 def split_image(file_im,files_masks):
     try:
@@ -134,30 +139,80 @@ def get_slice(r):
     else:
         return slice(0,r[0]),slice(0,r[1]),slice(0,r[2])
 
+def scaled_vox_map(ref_image,scaled_src_dims):
+    '''
+    Voxel-to-voxel affine from the reference grid to the 1mm scaled source grid.
+    Reproduces the mapping used by nibabel.processing.conform to return a scaled
+    image with sign-only affine to the reference grid, without touching voxel data.
+    '''
+    ref=ref_image
+    S=np.array(scaled_src_dims[:3])
+    pd=ref.header['pixdim']
+    src_aff=np.diag(np.append(np.sign(np.diagonal(ref.affine)[:3]),1))
+    out_aff=resample.conform_affine(src_aff,S,ref.shape[:3],(pd[1],pd[2],pd[3]))
+    return np.linalg.inv(src_aff) @ out_aff
+
+def footprint_in_ref(vox_map,src_range,ref_shape,margin):
+    '''
+    Bounding box in the reference grid of a [st,en) box in the scaled grid, grown by margin voxels.
+    Returns a list of [st,en] per axis, or None if the footprint is outside the reference image.
+    '''
+    lo=np.array([r[0] for r in src_range])-margin-1
+    hi=np.array([r[1] for r in src_range])+margin
+    corners=np.array([[c[0],c[1],c[2],1] for c in np.array(np.meshgrid(*zip(lo,hi))).reshape(3,-1).T])
+    ref_pts=(np.linalg.inv(vox_map) @ corners.T)[:3]
+    st=np.clip(np.floor(ref_pts.min(axis=1)).astype(int),0,ref_shape[:3])
+    en=np.clip(np.ceil(ref_pts.max(axis=1)).astype(int)+1,0,ref_shape[:3])
+    if np.any(en<=st): return None
+    return [[st[i],en[i]] for i in range(3)]
+
+def mask_dtype(voxels):
+    '''
+    Smallest integer type that holds all values of a label/mask array.
+    '''
+    if voxels.size==0: return np.dtype(np.uint8)
+    vmin,vmax=int(np.rint(voxels.min())),int(np.rint(voxels.max()))
+    return np.promote_types(np.min_scalar_type(vmin),np.min_scalar_type(vmax))
+
 def subimage2image(sub_image,ref_image,json_header,is_mask=True, overlay=False):
+    '''
+    Paste a subimage back into the reference image space.
+    Only the footprint of the subimage cube in the reference grid is resampled,
+    the rest of the output stays zero. Masks are written with an integer type.
+    '''
     sub,ref,js=sub_image,ref_image,json_header
-    #debug
-    #sub.to_filename('/data/temp/sub.nii')
-    #ref.to_filename('/data/temp/ref')
     print(js)
     
-    #1. Create a resampled copy of the reference image.   
-    d=np.zeros(js['scaled_src_dims'])
-    #2. Init source and target ranges
-    ssrc=get_slice(js['scaled_src_range'])
+    #interpolation order; spline support needs a zero margin around the cube.
+    order=0 if is_mask else 3
+    margin=0 if order<2 else 8
+    
+    #1. Init source and target ranges
+    rng=js['scaled_src_range']
     starg=get_slice(js['targ_range'])
+    cube=sub.get_fdata()[starg]
     
-    d[ssrc]=sub.get_fdata()[starg]
-    ref_sampled_im=nib.Nifti1Image(d,np.diag(np.sign(np.diagonal(ref_image.affine))))
-    #debug
-    #ref_sampled_im.to_filename('/data/temp/ref_sampled_im')    
-    pd=ref._header['pixdim']
+    #2. zero padded cube, indexed in scaled source space starting at rng[:][0]-margin
+    padded=np.pad(cube,margin) if margin>0 else cube
+    orig=np.array([r[0] for r in rng])-margin
     
-    #interpolation order
-    order=0 if is_mask else 3
-    res=nibabel.processing.conform(ref_sampled_im,ref.shape,voxel_size=(pd[1],pd[2],pd[3]),order=order)
+    #3. resample the cube footprint only.
+    vox_map=scaled_vox_map(ref,js['scaled_src_dims'])
+    out_dtype=mask_dtype(cube) if is_mask else np.dtype(np.float32)
+    out=np.zeros(ref.shape[:3],dtype=out_dtype)
+    box=footprint_in_ref(vox_map,rng,ref.shape,margin)
+    
+    if box is not None:
+        o0=np.array([b[0] for b in box])
+        box_map=vox_map.copy()
+        box_map[:3,3]=vox_map[:3,:3] @ o0 + vox_map[:3,3] - orig
+        part=resample.resample_array(padded,box_map,[b[1]-b[0] for b in box],order)
+        if is_mask: part=np.rint(part)
+        out[get_slice(box)]=part.astype(out_dtype)
+    
+    res=nib.Nifti1Image(out,ref.affine,header=ref.header)
+    res.set_data_dtype(out_dtype)
     res.set_sform(ref.affine)
-    #print(res.affine)
     return res
 
 
@@ -183,8 +238,10 @@ if __name__=="__main__":
     p.add_argument('--sub_img',metavar='<nifti file>',type=str,help='subimage root')
     p.add_argument('--sub_roi',metavar='<nifti file>',type=str,help='subimage based ROI root')
     p.add_argument('--suffix',metavar='<string>', type=str,help='output file suffix [_roi2subim, _subim2roi]')
+    p.add_argument('--no_cache',action='store_true',default=False,help='do not use the resampled image cache [$PYMIPL_CACHE_DIR]')
                 
     a=p.parse_args()
+    if a.no_cache: resample_cache.enabled=False
     suff=a.suffix if a.suffix is not None else '_'+a.command.replace('--','')
                 
     if a.command=='roi2subim':  
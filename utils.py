@@ -1,4 +1,23 @@
-import argparse, getpass, cmdline_provenance as cmdprov, os.path, nibabel as nib
+import sys, argparse, getpass, os.path, io, json, hashlib, numpy as np, importlib, importlib.util
+
+class LazyModule:
+    '''
+    Module proxy that imports the module on first attribute access.
+    '''
+    def __init__(self,name):
+        self._name=name
+        self._module=None
+
+    def __getattr__(self,attr):
+        if self._module is None:
+            self._module=importlib.import_module(self._name)
+        return getattr(self._module,attr)
+
+cmdprov=LazyModule('cmdline_provenance')
+nib=LazyModule('nibabel')
+
+def module_available(name):
+    return importlib.util.find_spec(name) is not None
 
 class IFH:
     def __init__(self):
@@ -43,6 +62,43 @@ class IFH:
                     v[key]=val              
         #print (v)
 
+    def get(self,key,default=None):
+        return self._vals.get(key,default)
+
+    def set(self,key,val):
+        self._vals[key]=val
+
+    def get_matrix_size(self):
+        '''
+        Image dimensions, fastest varying first: [x,y,z,t].
+        '''
+        return [self._vals.get('matrix size [{}]'.format(i),1) for i in range(1,5)]
+
+    def get_dtype(self):
+        '''
+        Numpy type of the voxel data, with byte order.
+        '''
+        nbytes=self._vals.get('number of bytes per pixel',4)
+        fmt=self._vals.get('number format','float').lower()
+        kind='f' if fmt.startswith('float') else ('u' if fmt.startswith('unsigned') else 'i')
+        order='>' if self._vals.get('imagedata byte order','bigendian').lower().startswith('big') else '<'
+        return np.dtype('{}{}{}'.format(order,kind,nbytes))
+
+    def set_data_format(self,shape,dtype):
+        '''
+        Set matrix size and number format keys for voxel data of the given [x,y,z(,t)] shape and type.
+        '''
+        dtype=np.dtype(dtype)
+        shape=list(shape)+[1]*(4-len(shape))
+        if 'INTERFILE' not in self._vals:
+            self._vals={'INTERFILE':'','version of keys':'3.3','conversion program':'pymipl',**self._vals}
+        v=self._vals
+        v['number format']='float' if dtype.kind=='f' else ('unsigned integer' if dtype.kind=='u' else 'int')
+        v['number of bytes per pixel']=dtype.itemsize
+        v['imagedata byte order']='bigendian' if (dtype.byteorder=='>' or (dtype.byteorder=='=' and sys.byteorder=='big')) else 'littleendian'
+        v['number of dimensions']=4
+        for i in range(4): v['matrix size [{}]'.format(i+1)]=int(shape[i])
+
     def __str__(self):
         v=self._vals
         with io.StringIO() as out:
@@ -77,7 +133,7 @@ class _4DFP:
     def get_copy(self):
         sai=self.analyze_image
         newim=_4DFP()
-        newim.analyze_image=nib.AnalyzeImage(get_voxels().copy(),sai.affine,sai.header)
+        newim.analyze_image=nib.AnalyzeImage(self.get_voxels().copy(),sai.affine,sai.header)
         newim.ifh=self.ifh
         newim.infile_list=self.infile_list
         return newim
@@ -107,6 +163,81 @@ class _4DFP:
         except Exception as e:
             print(e)
 
+class Mapped4DFP:
+    '''
+    4dfp image with the .4dfp.img payload memory-mapped using the dtype and byte order from the IFH.
+    Voxels are a cached [x,y,z,t] view of the file; nothing is copied unless another type is requested.
+    '''
+    def __init__(self,root=None,mode='r'):
+        self.ifh=IFH()
+        self.root=None
+        self._voxels=None
+        self.mode=mode
+        if root is not None: self.open(root,mode)
+
+    def open(self,root,mode='r'):
+        self.root,self.mode=root,mode
+        self.ifh.readIFH(root)
+        self._voxels=None
+
+    def get_voxels(self,dtype=None):
+        '''
+        [x,y,z,t] voxels: a view of the memory map in the file type, or a copy converted to dtype.
+        '''
+        if self._voxels is None:
+            nx,ny,nz,nt=self.ifh.get_matrix_size()
+            mm=np.memmap(self.root+'.4dfp.img',dtype=self.ifh.get_dtype(),mode=self.mode,shape=(nt,nz,ny,nx))
+            self._voxels=mm.transpose(3,2,1,0)
+        if dtype is None or np.dtype(dtype)==self._voxels.dtype: return self._voxels
+        return self._voxels.astype(dtype)
+
+    def get_frame(self,t,dtype=None):
+        '''
+        One [x,y,z] volume of a time series.
+        '''
+        v=self.get_voxels()[...,t]
+        return v if dtype is None else v.astype(dtype)
+
+    def flush(self):
+        if self._voxels is not None and self.mode!='r': self._voxels.base.flush()
+
+    @staticmethod
+    def create(root,shape,dtype=np.float32,ifh=None,byte_order='>'):
+        '''
+        Create an empty 4dfp image of [x,y,z(,t)] shape on disk and open it for writing.
+        '''
+        ifh=IFH() if ifh is None else ifh
+        dtype=np.dtype(dtype).newbyteorder(byte_order)
+        ifh.set_data_format(shape,dtype)
+        ifh.set('name of data file',os.path.basename(root))
+        ifh.writeIFH(root)
+        nx,ny,nz,nt=ifh.get_matrix_size()
+        np.memmap(root+'.4dfp.img',dtype=dtype,mode='w+',shape=(nt,nz,ny,nx)).flush()
+        im=Mapped4DFP()
+        im.ifh,im.root,im.mode=ifh,root,'r+'
+        return im
+
+    @staticmethod
+    def write(root,voxels,ifh=None,dtype=None,byte_order='>',slab_size:int=16,infile_list=[],signature=None):
+        '''
+        Write [x,y,z(,t)] voxels (any array, including a memory map or nibabel array proxy) to a 4dfp image,
+        one slab of z planes at a time. The file type is dtype [voxels.dtype] with the given byte order.
+        '''
+        shape=list(voxels.shape)+[1]*(4-len(voxels.shape))
+        dtype=np.dtype(voxels.dtype if dtype is None else dtype).newbyteorder(byte_order)
+        ifh=IFH() if ifh is None else ifh
+        ifh.set_data_format(shape,dtype)
+        ifh.set('name of data file',os.path.basename(root))
+        print('writing',root+'.4dfp.img')
+        with open(root+'.4dfp.img','wb') as f:
+            for t in range(shape[3]):
+                for z0 in range(0,shape[2],slab_size):
+                    z1=min(z0+slab_size,shape[2])
+                    slab=voxels[:,:,z0:z1,t] if len(voxels.shape)==4 else voxels[:,:,z0:z1]
+                    f.write(np.ascontiguousarray(np.asarray(slab).transpose(2,1,0),dtype=dtype).tobytes())
+        ifh.writeIFH(root)
+        write_rec_file_4dfp(root,infile_list,signature)
+
 def get_rec_file_root(root,main_extension):
     '''
     Construct .rec file from input file
@@ -150,33 +281,115 @@ def get_inlog_4dfp(root, inlogs):
     else:
         print('log file with root {} and rec extension does not exist'.format(root))
         
-def write_rec_file_4dfp(root:str,infiles=[]):
+def write_rec_file_4dfp(root:str,infiles=[],signature=None):
     '''
     Write log file for input extension.
     root: input file root
     main_extension: input file extension
     infiles: list of all input files that may have logs attached
+    signature: job signature for incremental runs, see job_signature
     '''    
     inlogs={}
     for file in infiles:
         get_inlog_4dfp(file,inlogs) 
-    outlog=cmdprov.new_log(infile_logs=inlogs,extra_notes=["user: "+getpass.getuser(),"node: "+os.uname()[1]])    
+    outlog=cmdprov.new_log(infile_logs=inlogs,extra_notes=get_rec_notes(signature))    
     outlog_file=root+'.4dfp.img.rec'    
     print('writing',outlog_file)
     cmdprov.write_log(outlog_file,outlog)
     
-def write_rec_file(root:str,main_extension=None,infiles=[]):
+def write_rec_file(root:str,main_extension=None,infiles=[],signature=None):
     '''
     Write log file for input extension.
     root: input file root
     main_extension: input file extension
     infiles: list of all input files that may have logs attached
+    signature: job signature for incremental runs, see job_signature
     '''
     
     inlogs={}
     for file in infiles:
         get_inlog(file,inlogs)
-    outlog=cmdprov.new_log(infile_logs=inlogs,extra_notes=["user: "+getpass.getuser(),"node: "+os.uname()[1]])
+    outlog=cmdprov.new_log(infile_logs=inlogs,extra_notes=get_rec_notes(signature))
     outlog_file=get_rec_file_root(root,main_extension)
     print('writing',outlog_file)
-    cmdprov.write_log(outlog_file,outlog)
\ No newline at end of file
+    cmdprov.write_log(outlog_file,outlog)
+
+'''
+Incremental runs. A job signature is a digest of the input file stamps (size and modification time,
+or content hashes) and the job parameters. It is recorded as the first extra note of the output's .rec
+file; a rerun skips the job if the output is newer than its inputs and the recorded signature matches.
+'''
+
+def get_rec_notes(signature=None):
+    notes=["user: "+getpass.getuser(),"node: "+os.uname()[1]]
+    return notes if signature is None else ["signature: "+signature]+notes
+
+def file_stamps(file:str, content_hash:bool=False):
+    '''
+    [path, size, mtime] or [path, blake2b hash] of a file, or of every file under a directory.
+    Missing files get [path, None].
+    '''
+    if os.path.isdir(file):
+        files=sorted([os.path.join(d,f) for d,_,fs in os.walk(file) for f in fs])
+    else:
+        files=[file]
+    stamps=[]
+    for f in files:
+        if not os.path.isfile(f):
+            stamps+=[[f,None]]
+        elif content_hash:
+            h=hashlib.blake2b(digest_size=20)
+            with open(f,'rb') as fin:
+                for chunk in iter(lambda: fin.read(1<<20),b''): h.update(chunk)
+            stamps+=[[f,h.hexdigest()]]
+        else:
+            st=os.stat(f)
+            stamps+=[[f,st.st_size,st.st_mtime_ns]]
+    return stamps
+
+def job_signature(infiles, params=None, content_hash:bool=False):
+    '''
+    Digest of input file stamps and job parameters (any JSON serializable object).
+    '''
+    sig=dict(inputs=[file_stamps(f,content_hash) for f in infiles],params=params,content_hash=content_hash)
+    return hashlib.blake2b(json.dumps(sig,sort_keys=True,default=str).encode(),digest_size=20).hexdigest()
+
+def job_params(tool:str, args, ignore=['incremental','hash','workers']):
+    '''
+    Job parameters from parsed command line arguments, leaving out those that do not change the output.
+    '''
+    params={ k:v for k,v in vars(args).items() if k not in ignore }
+    params['tool']=tool
+    return params
+
+def read_rec_signature(recfile:str):
+    '''
+    Signature recorded in the output's own entry of a .rec file (not in the attached input logs), or None.
+    '''
+    if not os.path.isfile(recfile): return None
+    with open(recfile,'r') as f:
+        lines=f.read().splitlines()
+    for i in range(len(lines)-1):
+        if lines[i].startswith('Extra notes:'):
+            return lines[i+1][len('signature: '):] if lines[i+1].startswith('signature: ') else None
+    return None
+
+def up_to_date(root:str, signature:str, infiles=[], main_extension=None):
+    '''
+    True if the output exists, is newer than all inputs and its .rec file records the same signature.
+    root, main_extension: output as passed to write_rec_file
+    '''
+    recfile=get_rec_file_root(root,main_extension)
+    outfile=recfile[:-len('.rec')]
+    if not os.path.isfile(outfile) or read_rec_signature(recfile)!=signature: return False
+    out_mtime=os.stat(outfile).st_mtime_ns
+    for file in infiles:
+        for stamp in file_stamps(file):
+            if stamp[1] is None or stamp[2]>out_mtime: return False
+    return True
+
+def add_incremental_args(parser):
+    parser.add_argument('--incremental',action='store_true',default=False,
+                        help='skip jobs whose output is newer than the inputs and was made with the same inputs and parameters [False]')
+    parser.add_argument('--hash',action='store_true',default=False,
+                        help='identify inputs by content hash instead of size and modification time [False]')